@@ -1,10 +1,14 @@
 import os
+import tempfile
+import threading
+from collections import OrderedDict
 from math import pi
 
 import numpy as np
 
-from fda.zernike_annular_polynomial import ZernikeAnnularSingle as ZernikeAnnular
-from fda.zernike_circular_polynomial import ZernikeCircularSingle as ZernikeCircular
+from fda.zernike_annular_polynomial import ZernikeAnnularSingleVector as ZernikeAnnular
+from fda.zernike_circular_polynomial import ZernikeCircularSingleVector as ZernikeCircular
+from fda.zernike_radial_polynomial import RadialTable, SingleToDouble
 
 # ----------------------------------------------------------------------------------
 
@@ -14,17 +18,40 @@ ext = "npy"
 # mfs matrices path
 mfs_path = "./encoding/mfs"
 
+# version of the mf matrices, part of their file names. The matrices saved before v2 were
+# built with wrong radial steps and orders (degenerate), so they must not be loaded
+MFS_VERSION = "v2"
+
+# maximum amount of matrices kept in memory by each of the caches below
+MFS_CACHE_SIZE = 8
+
+# mf matrices in memory (least recently used first), indexed by path
+mfs_cache = OrderedDict()
+
+# least squares projectors (pseudo-inverses of the mf matrices) in memory, indexed by name
+projectors_cache = OrderedDict()
+
+# gram matrices (Mf' * Mf) in memory, indexed by name
+grams_cache = OrderedDict()
+
+# orthogonal projection matrices (quadrature weighted basis) in memory, indexed by name
+moments_cache = OrderedDict()
+
+# the caches are shared by every thread
+caches_lock = threading.Lock()
+
 # ----------------------------------------------------------------------------------
 
 
-def ComputeMfCircular(width, height, order):
+def ComputeMfCircular(width, height, order, dtype=np.float64):
     # creating mf matrix name
-    mf_name = get_mf_circ_name(width, height, order)
+    mf_name = get_mf_circ_name(width, height, order, dtype)
     mf_path = "%s/%s.%s" % (mfs_path, mf_name, ext)
 
     # if already computed, then return it
-    if exists_mf(mf_path):
-        return np.load(mf_path)
+    Mf = load_mf(mf_path)
+    if Mf is not None:
+        return Mf
 
     # computing size
     size = width * height
@@ -33,26 +60,32 @@ def ComputeMfCircular(width, height, order):
     Mf = np.empty((size, order), np.float64)
 
     ub = order + 1
+
+    # radial polynomials of every column at once (lower orders are reused)
+    rho, _ = get_polar_grid(width, height, 1.0 / height, 1.0 / height)
+    radial_table = RadialTable([SingleToDouble(j) for j in range(1, ub)], rho)
+
     for j in range(1, ub):
-        Mv = FillRectCircular(width, height, order)
+        Mv = FillRectCircular(width, height, j, radial_table)
         Vv = Mv.reshape((size,))
         Mf[:, j - 1] = Vv
 
-    # saving the computed Mf matrix
-    np.save(mf_path, Mf)
+    # saving the computed Mf matrix (in the requested precision)
+    Mf = save_mf(mf_path, Mf.astype(dtype, copy=False))
 
     #returning the Mf matrix
     return Mf
 
 
-def ComputeMfAnnular(width, height, order, eps_lb, eps_ub):
+def ComputeMfAnnular(width, height, order, eps_lb, eps_ub, dtype=np.float64):
     # creating mf matrix name
-    mf_name = get_mf_annu_name(width, height, order, eps_lb, eps_ub)
+    mf_name = get_mf_annu_name(width, height, order, eps_lb, eps_ub, dtype)
     mf_path = "%s/%s.%s" % (mfs_path, mf_name, ext)
 
     # if already computed, then return it
-    if exists_mf(mf_path):
-        return np.load(mf_path)
+    Mf = load_mf(mf_path)
+    if Mf is not None:
+        return Mf
 
     # computing size
     size = width * height
@@ -66,35 +99,181 @@ def ComputeMfAnnular(width, height, order, eps_lb, eps_ub):
         Vv = Mv.reshape((size,))
         Mf[:, j - 1] = Vv
 
-    # saving the computed Mf matrix
-    np.save(mf_path, Mf)
+    # saving the computed Mf matrix (in the requested precision)
+    Mf = save_mf(mf_path, Mf.astype(dtype, copy=False))
 
     #returning the Mf matrix
     return Mf
 
 
-def FillRectCircular(width, height, order):
+def ComputeProjectorCircular(width, height, order, dtype=np.float64):
+    key = get_mf_circ_name(width, height, order, dtype)
+
+    # if already computed, then return it
+    return get_cached_matrix(projectors_cache, key, lambda: compute_projector(ComputeMfCircular(width, height, order, dtype)))
+
+
+def ComputeProjectorAnnular(width, height, order, eps_lb, eps_ub, dtype=np.float64):
+    key = get_mf_annu_name(width, height, order, eps_lb, eps_ub, dtype)
+
+    # if already computed, then return it
+    return get_cached_matrix(projectors_cache, key, lambda: compute_projector(ComputeMfAnnular(width, height, order, eps_lb, eps_ub, dtype)))
+
+
+# the least squares solution of Mf * x = b is x = P * b, where P is the pseudo-inverse of Mf
+def compute_projector(Mf):
+    projector = np.linalg.pinv(Mf)
+
+    # it is shared by every encoding, so nobody should modify it
+    projector.flags.writeable = False
+
+    return projector
+
+
+def ComputeGramCircular(width, height, order, dtype=np.float64):
+    key = get_mf_circ_name(width, height, order, dtype)
+
+    # if already computed, then return it
+    return get_cached_matrix(grams_cache, key, lambda: compute_gram(ComputeMfCircular(width, height, order, dtype)))
+
+
+def ComputeGramAnnular(width, height, order, eps_lb, eps_ub, dtype=np.float64):
+    key = get_mf_annu_name(width, height, order, eps_lb, eps_ub, dtype)
+
+    # if already computed, then return it
+    return get_cached_matrix(grams_cache, key, lambda: compute_gram(ComputeMfAnnular(width, height, order, eps_lb, eps_ub, dtype)))
+
+
+def compute_gram(Mf):
+    gram = Mf.T.dot(Mf)
+
+    # it is shared by every encoding, so nobody should modify it
+    gram.flags.writeable = False
+
+    return gram
+
+
+def ComputeMomentsCircular(width, height, order, dtype=np.float64):
+    key = get_mf_circ_name(width, height, order, dtype)
+
+    # if already computed, then return it
+    return get_cached_matrix(moments_cache, key, lambda: compute_moments(ComputeMfCircular(width, height, order, dtype),
+                                                                        ComputeWeightsCircular(width, height)))
+
+
+def ComputeMomentsAnnular(width, height, order, eps_lb, eps_ub, dtype=np.float64):
+    key = get_mf_annu_name(width, height, order, eps_lb, eps_ub, dtype)
+
+    # if already computed, then return it
+    return get_cached_matrix(moments_cache, key, lambda: compute_moments(ComputeMfAnnular(width, height, order, eps_lb, eps_ub, dtype),
+                                                                        ComputeWeightsAnnular(width, height, eps_lb, eps_ub)))
+
+
+# quadrature weights of the circular grid (rho in (0, 1])
+def ComputeWeightsCircular(width, height):
+    dr = 1.0 / height
+    return get_quadrature_weights(width, height, dr, dr, False)
+
+
+# quadrature weights of the annular grid (rho in [eps_lb, eps_ub])
+def ComputeWeightsAnnular(width, height, eps_lb, eps_ub):
+    dr = (eps_ub - eps_lb) / (height - 1)
+    return get_quadrature_weights(width, height, eps_lb, dr, True)
+
+
+# The zernike basis is orthogonal, so the moment of each polynomial is the inner product
+# <Z_j, b> / <Z_j, Z_j>, computed as a quadrature over the polar grid. Returns the matrix
+# (order x size) whose rows are w * Z_j / <Z_j, Z_j>, so the moments are M * b.
+# The basis is only orthogonal in the continuum, not on the sampled grid, so this is an
+# approximation that does not match the least squares moments (ComputeProjector*): the
+# relative error is about 100% on raw images and 6-17% with the mean removed
+def compute_moments(Mf, weights):
+    weighted = Mf.T * weights.astype(Mf.dtype)
+    moments = weighted / (weighted * Mf.T).sum(axis=1, keepdims=True)
+
+    # it is shared by every encoding, so nobody should modify it
+    moments.flags.writeable = False
+
+    return moments
+
+
+# weights of the polar grid samples (rho * dr * dtheta) as a vector of size width * height,
+# following the trapezoidal rule in rho. The last row is the end of the radial interval, and
+# the first one is its start only if it is closed (in the circular grid the start is rho = 0,
+# which is not sampled because its weight is 0)
+def get_quadrature_weights(width, height, rho_0, dr, closed):
+    rho, _ = get_polar_grid(width, height, rho_0, dr)
+
+    weights = rho * dr * (2 * pi / width)
+    weights[-1] /= 2.0
+    if closed:
+        weights[0] /= 2.0
+
+    return np.repeat(weights, width)
+
+
+# Computes the moments of every image (row of B) as in compute_moments, but with the quadrature
+# weights of the occluded pixels (0 in the row of masks) set to 0, so each moment is
+# <Z_j, b>_w / <Z_j, Z_j>_w with w = weights * mask. The moments of the polynomials that are
+# 0 on every good pixel are set to 0. As compute_moments, it is an approximation that does not
+# match the least squares moments (SolveMasked)
+def ProjectMasked(Mf, weights, B, masks):
+    W = (masks != 0) * weights.astype(Mf.dtype)
+
+    num = (B * W).dot(Mf)
+    den = W.dot(Mf * Mf)
+
+    X = np.zeros(num.shape, B.dtype)
+    np.divide(num, den, out=X, where=den != 0)
+
+    return X
+
+
+# Solves the weighted normal equations (Mf' * W * Mf) x = Mf' * W * b of every image (row of
+# B), where W is the diagonal matrix of the image mask (row of masks). The gram matrix
+# Mf' * Mf does not depend on the mask, so only the rows of the occluded pixels are
+# removed from it (or the good rows are used if most of the pixels are occluded).
+def SolveMasked(Mf, gram, B, masks):
+    count = B.shape[0]
+    X = np.empty((count, Mf.shape[1]), B.dtype)
+
+    for k in range(count):
+        good = masks[k] != 0
+        bad = np.logical_not(good)
+
+        if np.count_nonzero(bad) <= np.count_nonzero(good):
+            Mf_bad = Mf[bad]
+            MtWM = gram - Mf_bad.T.dot(Mf_bad)
+        else:
+            Mf_good = Mf[good]
+            MtWM = Mf_good.T.dot(Mf_good)
+
+        MtWb = Mf.T.dot(B[k] * good)
+
+        # the system might be singular if too many pixels are occluded
+        X[k] = np.linalg.lstsq(MtWM, MtWb, rcond=None)[0]
+
+    return X
+
+
+def FillRectCircular(width, height, order, radial_table=None):
     # computing iris ring radius
     i_radius = 1.0  # unitary disk
 
     # computing deltha of radius (amount to add to the radius)
-    dr = i_radius // height
-
-    # creating rectangle
-    rect = np.empty((height, width), np.float64)
-
-    for a in range(width):
-        # computing theta
-        theta = a * (2 * pi) / width
+    dr = i_radius / height
 
-        for r in range(height):
-            # computing rho
-            rho = dr + r * dr
+    # sampling the whole (rho, theta) grid at once
+    rho, theta = get_polar_grid(width, height, dr, dr)
 
-            # # saving value of zernike circular polynomial in rect
-            rect[r, a] = ZernikeCircular(order, rho, theta)
+    # getting the radial contribution if already computed
+    rnm = None
+    if radial_table is not None:
+        n, m = SingleToDouble(order)
+        rnm = radial_table[(n, abs(m))]
 
-    return rect
+    # evaluating the zernike circular polynomial in the grid
+    return ZernikeCircular(order, rho, theta, rnm)
 
 
 def FillRectAnnular(width, height, order, eps_lb, eps_ub):
@@ -102,32 +281,104 @@ def FillRectAnnular(width, height, order, eps_lb, eps_ub):
     i_radius = eps_ub - eps_lb
 
     # computing deltha of radius (amount to add to the radius)
-    dr = i_radius // (height - 1)
+    dr = i_radius / (height - 1)
 
-    # creating rectangle
-    rect = np.empty((height, width), np.float64)
+    # sampling the whole (rho, theta) grid at once
+    rho, theta = get_polar_grid(width, height, eps_lb, dr)
 
-    for a in range(width):
-        # computing theta
-        theta = a * (2 * pi) / width
-        for r in range(height):
-            # computing rho
-            rho = eps_lb + r * dr
+    # evaluating the zernike annular polynomial in the grid
+    return ZernikeAnnular(order, rho, theta, eps_lb, eps_ub)
 
-            # saving value of zernike annular polynomial in rect
-            rect[r, a] = ZernikeAnnular(order, rho, theta, eps_lb, eps_ub)
 
-    # returning the evaluated rectangle
-    return rect
+# returns rho as a column (height x 1) and theta as a row (1 x width), so together they
+# broadcast to the (height x width) grid of the normalized image
+def get_polar_grid(width, height, rho_0, dr):
+    rho = rho_0 + dr * np.arange(height, dtype=np.float64).reshape((height, 1))
+    theta = np.arange(width, dtype=np.float64).reshape((1, width)) * (2 * pi) / width
+
+    return rho, theta
+
+
+# returns the mf matrix from memory, or from disk (memory-mapped) if it was saved by
+# this or any other process, or None if it has not been computed yet
+def load_mf(mf_path):
+    Mf = find_cached_matrix(mfs_cache, mf_path)
+    if Mf is not None:
+        return Mf
+
+    if not exists_mf(mf_path):
+        return None
+
+    return cache_matrix(mfs_cache, mf_path, np.load(mf_path, mmap_mode="r"))
+
+
+# saves the mf matrix on disk and in memory. The file is written with a temporary name and
+# then renamed, so concurrent processes never read a partially written matrix
+def save_mf(mf_path, Mf):
+    mf_dir = os.path.dirname(mf_path)
+    os.makedirs(mf_dir, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(suffix="." + ext, dir=mf_dir)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            np.save(tmp_file, Mf)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, mf_path)
+    except OSError:
+        # the matrix is still valid, it just will be computed again next time
+        if os.access(tmp_path, os.F_OK):
+            os.remove(tmp_path)
+
+    return cache_matrix(mfs_cache, mf_path, Mf)
+
+
+# returns the matrix of the key from one of the caches (marking it as the most recently used),
+# or None if it is not there
+def find_cached_matrix(cache, key):
+    with caches_lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+
+    return None
+
+
+# stores the (read-only) matrix in one of the caches, evicting the least recently used one
+def cache_matrix(cache, key, matrix):
+    matrix.flags.writeable = False
+
+    with caches_lock:
+        cache[key] = matrix
+        cache.move_to_end(key)
+
+        while len(cache) > MFS_CACHE_SIZE:
+            cache.popitem(last=False)
+
+    return matrix
+
+
+# returns the matrix of the key from one of the caches, computing it with compute() (outside
+# of the lock, two threads might compute the same matrix) if it is not there
+def get_cached_matrix(cache, key, compute):
+    matrix = find_cached_matrix(cache, key)
+    if matrix is None:
+        matrix = cache_matrix(cache, key, compute())
+
+    return matrix
 
 
 def exists_mf(mf_path):
     return os.access(mf_path, os.F_OK)
 
 
-def get_mf_circ_name(width, height, order):
-    return "%i_%i_%i" % (width, height, order)
+def get_mf_circ_name(width, height, order, dtype=np.float64):
+    return "%i_%i_%i_%s%s" % (width, height, order, MFS_VERSION, get_dtype_suffix(dtype))
+
+
+def get_mf_annu_name(width, height, order, eps_lb, eps_ub, dtype=np.float64):
+    return "%i_%i_%i_%.2f_%.2f_%s%s" % (width, height, order, eps_lb, eps_ub, MFS_VERSION, get_dtype_suffix(dtype))
 
 
-def get_mf_annu_name(width, height, order, eps_lb, eps_ub):
-    return "%i_%i_%i_%.2f_%.2f" % (width, height, order, eps_lb, eps_ub)
\ No newline at end of file
+# double precision matrices have no dtype suffix
+def get_dtype_suffix(dtype):
+    return "" if np.dtype(dtype) == np.float64 else "_" + np.dtype(dtype).name
\ No newline at end of file
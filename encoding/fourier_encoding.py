@@ -1,90 +1,67 @@
 import numpy as np
-import numpy.fft as fmath
 
 from utils.error_utils import SUCCESS
+from utils.image_utils import render_heatmap
+from utils.math_utils import fft2
 
 
-def encode_iris(norm_img, mask_img, angular_resolution, radial_resolution):
+def encode_iris(norm_img, mask_img, angular_resolution, radial_resolution, packed=False, dtype=np.float64):
     # getting image dimensions
     height, width = norm_img.shape
 
-    # getting radii and angles
-    radii, angles = height, width
+    # encoding the image as a batch of one image
+    norm_imgs = norm_img.reshape((1, height, width))
+    mask_imgs = mask_img.reshape((1, height, width))
+    result, bit_codes, bit_code_masks = encode_iris_batch(norm_imgs, mask_imgs, angular_resolution, radial_resolution, packed, dtype)
 
-    #creating the bitcode and it's mask
-    bit_code = np.empty(2 * width * height, np.uint8)
-    bit_code_mask = np.empty(2 * width * height, np.uint8)
+    return result, bit_codes[0], bit_code_masks[0]
 
-    # ecoding image
-    encoded_img = fourier_image(norm_img)
 
-    # creating index
-    index = 0
-    for radius in range(radii):
-        for theta in range(angles):
-            real = 1 if encoded_img[radius, theta].real >= 0.0 else 0
-            imag = 1 if encoded_img[radius, theta].imag >= 0.0 else 1
+# encodes a stack of normalized images (count x height x width) at once
+def encode_iris_batch(norm_imgs, mask_imgs, angular_resolution, radial_resolution, packed=False, dtype=np.float64):
+    count = norm_imgs.shape[0]
+
+    # ecoding images
+    encoded_imgs = fourier_image(norm_imgs, dtype)
+
+    # quantising the phase of every pixel
+    real, imag = phase_bits(encoded_imgs)
+
+    # interleaving the bits (real, imag) of each pixel
+    bit_codes = np.stack((real, imag), axis=-1).reshape((count, -1))
+
+    # both bits of a pixel share the value of the mask
+    bit_code_masks = np.repeat(mask_imgs.reshape((count, -1)) != 0, 2, axis=1).astype(np.uint8)
 
-            bit_code[index] = real
-            bit_code[index + 1] = imag
+    # packing the bits in words (8 bits per element)
+    if packed:
+        return SUCCESS, np.packbits(bit_codes, axis=1), np.packbits(bit_code_masks, axis=1)
 
-            if mask_img[radius, theta]:
-                bit_code_mask[index] = 1
-                bit_code_mask[index + 1] = 1
-            else:
-                bit_code_mask[index] = 0
-                bit_code_mask[index + 1] = 0
+    return SUCCESS, bit_codes, bit_code_masks
 
-            index += 2
 
-    return SUCCESS, bit_code, bit_code_mask
+# returns the bit planes (real, imag) of the quantised phase of an encoded image
+def phase_bits(encoded_img):
+    real = (encoded_img.real >= 0.0).astype(np.uint8)
+    imag = (encoded_img.imag >= 0.0).astype(np.uint8)
 
+    return real, imag
 
-def fourier_image(img):
-    return fmath.fft2(img)
+
+# the transform is computed in the given precision (float64 or float32). A stack of images
+# (count x height x width) is transformed image by image
+def fourier_image(img, dtype=np.float64):
+    return fft2(img, dtype)
 
 
 def generate_heatmap(norm_img):
     if norm_img is None:
         return None
 
-    # getting image dimensions
-    radii, angles = norm_img.shape
-
-    #creating heatmap image and mask
-    heatmap = np.empty((radii, angles, 3), np.uint8)
-
     # ecoding image
     encoded_img = fourier_image(norm_img)
 
-    for i in range(radii):
-        for j in range(angles):
-            if i <= 4 or i >= (radii - 4):
-                #setting black color
-                heatmap.itemset(i, j, 0, 0)
-                heatmap.itemset(i, j, 1, 0)
-                heatmap.itemset(i, j, 2, 0)
-            else:
-                real = 1 if encoded_img[i, j].real >= 0.0 else 0
-                imag = 1 if encoded_img[i, j].imag >= 0.0 else 1
-
-                if imag:
-                    if real:
-                        heatmap.itemset(i, j, 0, 91)
-                        heatmap.itemset(i, j, 1, 102)
-                        heatmap.itemset(i, j, 2, 166)
-                    else:
-                        heatmap.itemset(i, j, 0, 91)
-                        heatmap.itemset(i, j, 1, 140)
-                        heatmap.itemset(i, j, 2, 77)
-                else:
-                    if real:
-                        heatmap.itemset(i, j, 0, 120)
-                        heatmap.itemset(i, j, 1, 120)
-                        heatmap.itemset(i, j, 2, 120)
-                    else:
-                        heatmap.itemset(i, j, 0, 217)
-                        heatmap.itemset(i, j, 1, 179)
-                        heatmap.itemset(i, j, 2, 145)
-
-    return heatmap
\ No newline at end of file
+    # getting encoded pixels info
+    real, imag = phase_bits(encoded_img)
+
+    return render_heatmap(real, imag)
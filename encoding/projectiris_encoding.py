@@ -1,8 +1,9 @@
 import numpy as np
 
-from math import sin, cos, pi, exp, pow
+from math import pi
 
 from utils.error_utils import SUCCESS, RESOLUTION_ERROR
+from utils.image_utils import render_heatmap
 
 #--------------------------------------------------------------------------------
 
@@ -10,6 +11,11 @@ GAUSSIAN_SCALE = 0.4770322291
 
 SIN = 0
 COS = 1
+GAUSSIAN = 2
+
+GAUSSIAN_PEAK = 15.0
+
+HEATMAP_FILTER_SIZE = 9
 
 ENCODED_PIXELS = 1024                   # should be divisible by 32(int) or 64(long)
 
@@ -17,6 +23,11 @@ BITCODE_LENGTH = 2 * ENCODED_PIXELS     # each encoded pixel brings 2 bits to th
 
 #--------------------------------------------------------------------------------
 
+# already built filters, indexed by ("sinusoidal", size, type, peak) or ("gaussian", size, peak)
+filters_cache = {}
+
+#--------------------------------------------------------------------------------
+
 
 #ToDo: Python code here. Optimize it with cython or anything like that.
 #ToDo: Optimize implementation. DO NOT COMPUTE what is not necessary (if noise => do not compute anything for that)
@@ -105,56 +116,43 @@ def is_good_filter(radius, theta, filter_height, mask):
     return ratio >= good_ratio
 
 
-#ToDo: Python code here. Optimize it with cython or anything like that.
-#ToDo: The color assignment is non-pythonic code. Fix it.
 def generate_heatmap(norm_img):
     if norm_img is None:
         return None
 
-    # getting image dimensions
-    radii, angles = norm_img.shape
-
-    #creating heatmap image and mask
-    heatmap = np.empty((radii, angles, 3), np.uint8)
-    mask = np.ones((radii, angles), np.int32)   # all pixels are valid
+    #creating the mask
+    mask = np.ones(norm_img.shape, np.int32)   # all pixels are valid
 
     #generating filters
-    filter_size = 9
-    sin_filter = generate_sinusoidal_filter(filter_size, SIN)
-    cos_filter = generate_sinusoidal_filter(filter_size, COS)
-
-    for i in range(radii):
-        for j in range(angles):
-            if i <= (filter_size // 2) or i >= (radii - (filter_size // 2)):
-                #setting black color
-                heatmap.itemset(i, j, 0, 0)
-                heatmap.itemset(i, j, 1, 0)
-                heatmap.itemset(i, j, 2, 0)
-            else:
-                #applying filters
-                real = gabor_pixel(i, j, cos_filter, norm_img, mask)
-                imag = gabor_pixel(i, j, sin_filter, norm_img, mask)
-
-                if imag:
-                    if real:
-                        heatmap.itemset(i, j, 0, 91)
-                        heatmap.itemset(i, j, 1, 102)
-                        heatmap.itemset(i, j, 2, 166)
-                    else:
-                        heatmap.itemset(i, j, 0, 91)
-                        heatmap.itemset(i, j, 1, 140)
-                        heatmap.itemset(i, j, 2, 77)
-                else:
-                    if real:
-                        heatmap.itemset(i, j, 0, 120)
-                        heatmap.itemset(i, j, 1, 120)
-                        heatmap.itemset(i, j, 2, 120)
-                    else:
-                        heatmap.itemset(i, j, 0, 217)
-                        heatmap.itemset(i, j, 1, 179)
-                        heatmap.itemset(i, j, 2, 145)
-
-    return heatmap
+    sin_filter = generate_sinusoidal_filter(HEATMAP_FILTER_SIZE, SIN)
+    cos_filter = generate_sinusoidal_filter(HEATMAP_FILTER_SIZE, COS)
+
+    #applying filters
+    real = gabor_image(cos_filter, norm_img, mask)
+    imag = gabor_image(sin_filter, norm_img, mask)
+
+    return render_heatmap(real, imag, HEATMAP_FILTER_SIZE // 2)
+
+
+# applies gabor_pixel to every pixel of the image at once (radially, the filter wraps
+# around the image as well, so only rows with a complete filter are meaningful)
+def gabor_image(sinusoidal_filter, norm_img, mask_img):
+    # size of the filter to be applied
+    filter_size = sinusoidal_filter.shape[0]   # we assume that the filter is sqared
+    half_size = filter_size // 2
+
+    # only good pixels contribute to the sum
+    values = np.where(mask_img, norm_img, 0).astype(np.float64)
+
+    # running total used for integration (same order of the sum than gabor_pixel)
+    running_total = np.zeros(values.shape, np.float64)
+    for i in range(filter_size):
+        for j in range(filter_size):
+            shifted = np.roll(np.roll(values, half_size - i, axis=0), half_size - j, axis=1)
+            running_total += sinusoidal_filter[i, j] * shifted
+
+    # 1 if +ve and 0 if -ve
+    return (running_total >= 0.0).astype(np.uint8)
 
 
 #ToDo: Python code here. Optimize it with cython or anything like that.
@@ -189,77 +187,65 @@ def gabor_pixel(rho, phi, sinusoidal_filter, norm_img, mask_img):
     return 1 if running_total >= 0.0 else 0
 
 
-#ToDo: Python code here. Optimize it with cython or anything like that.
-def generate_sinusoidal_filter(size, sinusoidal_type):
-    sum_row = 0.0
-    sin_filter = np.empty((size, size), np.float64)
+def generate_sinusoidal_filter(size, sinusoidal_type, peak=GAUSSIAN_PEAK):
+    key = ("sinusoidal", size, sinusoidal_type, peak)
+
+    # if already built, then return it
+    if key in filters_cache:
+        return filters_cache[key]
+
+    # phase of each column (every row of the filter is the same wave)
+    phi = np.arange(size, dtype=np.float64) - (size // 2)
 
     if sinusoidal_type == SIN:
-        wave_fun = lambda phi: sin(pi * phi / (size // 2))
+        wave = np.sin(pi * phi / (size // 2))
 
     elif sinusoidal_type == COS:
-        wave_fun = lambda phi: cos(pi * phi / (size // 2))
+        wave = np.cos(pi * phi / (size // 2))
 
     # unknown filter type
     else:
         return None
 
-    # filling first row
-    for j in range(size):
-        phi = j - (size // 2)
-        wave_value = wave_fun(phi)
-        sin_filter.itemset(0, j, wave_value)
-        sum_row += wave_value
-
-    # normalizing first row
-    for j in range(size):
-        old_value = sin_filter.item(0, j)
-        sin_filter.itemset(0, j, old_value - (sum_row / size))
+    # normalizing the wave and filling the filter with it
+    wave -= wave.sum() / size
+    sin_filter = np.tile(wave, (size, 1))
 
-    #filling filter
-    for i in range(1, size):
-        for j in range(size):
-            sin_filter.itemset(i, j, sin_filter.item(0, j))
-
-    #generating gaussian filter
-    gaussian_filter = generate_gaussian_filter(size)
-
-    #multiplying both filters
-    for i in range(size):
-        for j in range(size):
-            new_value = sin_filter.item(i, j) * gaussian_filter.item(i, j)
-            sin_filter.itemset(i, j, new_value)
+    # multiplying by the gaussian filter
+    sin_filter *= generate_gaussian_filter(size, peak)
 
     # make every row have equal +ve and -ve
-    for i in range(size):
-        #computing row_sum
-        row_sum = 0.0
-        for j in range(size):
-            row_sum += sin_filter.item(i, j)
+    sin_filter -= sin_filter.sum(axis=1, keepdims=True) / size
 
-        #normalizing
-        for j in range(size):
-            old_value = sin_filter.item(i, j)
-            sin_filter.itemset(i, j, old_value - (row_sum / size))
+    return cache_filter(key, sin_filter)
 
-    return sin_filter
 
+def generate_gaussian_filter(size, peak=GAUSSIAN_PEAK):
+    key = ("gaussian", size, peak)
+
+    # if already built, then return it
+    if key in filters_cache:
+        return filters_cache[key]
 
-#ToDo: Python code here. Optimize it with cython or anything like that.
-def generate_gaussian_filter(size, peak=15.0):
     # Scale the constants so that gaussian is always in the same range
     # Uses alpha = dimension * (4sqrt(-ln(1/3)))**-1
     # The gaussian will have the value peak/3 at each of its edges
     # and peak/9 at its corners
     alpha = (size - 1) * GAUSSIAN_SCALE
     beta = alpha
-    gaussian_filter = np.empty((size, size), np.float64)
 
-    for i in range(size):
-        rho = i - (size / 2)
-        for j in range(size):
-            phi = j - (size / 2)
-            wave_value = peak * exp(-pow(rho, 2.0) / pow(alpha, 2.0)) * exp(-pow(phi, 2.0) / pow(beta, 2.0))
-            gaussian_filter.itemset(i, j, wave_value)
+    rho = np.arange(size, dtype=np.float64) - (size / 2)
+    phi = np.arange(size, dtype=np.float64) - (size / 2)
+
+    # the gaussian is separable, so it is the outer product of both directions
+    gaussian_filter = peak * np.outer(np.exp(-rho ** 2 / alpha ** 2), np.exp(-phi ** 2 / beta ** 2))
+
+    return cache_filter(key, gaussian_filter)
+
+
+# stores a filter in the cache as a read-only array (it is shared by every caller)
+def cache_filter(key, filter_array):
+    filter_array.flags.writeable = False
+    filters_cache[key] = filter_array
 
-    return gaussian_filter
\ No newline at end of file
+    return filter_array
@@ -1,39 +1,63 @@
-import cv2
 import numpy as np
 
-from encoding.fda_encoding import ComputeMfAnnular
+from encoding.fda_encoding import ComputeMfAnnular, ComputeGramAnnular, ComputeProjectorAnnular, ComputeMomentsAnnular, SolveMasked, \
+    ComputeWeightsAnnular, ProjectMasked
 
 from utils.error_utils import SUCCESS, UNKNOWN_FAIL
+from utils.recognition_definitions import ZERNIKE_LEAST_SQUARES, ZERNIKE_PROJECTION
 
 
-def encode_iris(norm_img, mask_img, order=16, eps_lb=0.25, eps_ub=1.0):
+# if use_mask is set, occluded pixels (according to mask_img) are not taken into account
+def encode_iris(norm_img, mask_img, order=16, eps_lb=0.25, eps_ub=1.0, use_mask=False, method=ZERNIKE_LEAST_SQUARES, dtype=np.float64):
     # getting image dimensions
     height, width = norm_img.shape
 
-    # computing Mf matrix
-    A = ComputeMfAnnular(width, height, order, eps_lb, eps_ub)
+    # encoding the image as a batch of one image
+    norm_imgs = norm_img.reshape((1, height, width))
+    mask_imgs = mask_img.reshape((1, height, width)) if use_mask else None
+    result, x, _ = encode_iris_batch(norm_imgs, mask_imgs, order, eps_lb, eps_ub, use_mask, method, dtype)
 
-    # reshaping image (as a column vector)
-    b = norm_img.reshape((height * width,))
+    # if there was an error of some kind
+    if result != SUCCESS:
+        return result, None, None
 
-    # changing datatype to float64
-    b = b.astype(np.float64)
+    # returning the solution as a column vector
+    return SUCCESS, x.reshape((order, 1)), None
 
-    # # applying mask to the Mf matrix and the normalized image
-    # mask_img = mask_img.reshape((height * width,))
-    # # creating the filter
-    # mask = mask_img[:] == 1
-    #
-    # # filtering Mf and normalized image
-    # A = A[mask]     # getting only "good" rows
-    # b = b[mask]     # getting only "good" rows
 
-    # solving the corresponding SEL (Ax = b) by min squares
-    result, x = cv2.solve(src1=A, src2=b, flags=cv2.DECOMP_QR)
+# encodes a stack of normalized images (count x height x width) at once
+def encode_iris_batch(norm_imgs, mask_imgs, order=16, eps_lb=0.25, eps_ub=1.0, use_mask=False, method=ZERNIKE_LEAST_SQUARES, dtype=np.float64):
+    # getting images dimensions
+    count, height, width = norm_imgs.shape
 
-    # if there was an error of some kind
-    if not result:
+    # reshaping images (as row vectors) and changing datatype to the working precision
+    B = norm_imgs.reshape((count, height * width)).astype(dtype)
+
+    try:
+        # computing the moments as inner products with the basis (an approximation, the codes do not
+        # match the least squares ones, see compute_moments)
+        if method == ZERNIKE_PROJECTION and not use_mask:
+            M = ComputeMomentsAnnular(width, height, order, eps_lb, eps_ub, dtype)
+            X = B.dot(M.T)
+
+        # computing the moments as inner products weighted by the mask (only the good pixels)
+        elif method == ZERNIKE_PROJECTION:
+            A = ComputeMfAnnular(width, height, order, eps_lb, eps_ub, dtype)
+            X = ProjectMasked(A, ComputeWeightsAnnular(width, height, eps_lb, eps_ub), B, mask_imgs.reshape((count, height * width)))
+
+        # solving every SEL (Ax = b) by min squares with a single product
+        elif not use_mask:
+            P = ComputeProjectorAnnular(width, height, order, eps_lb, eps_ub, dtype)
+            X = B.dot(P.T)
+
+        # solving every SEL (A'WAx = A'Wb) taking only the good pixels
+        else:
+            A = ComputeMfAnnular(width, height, order, eps_lb, eps_ub, dtype)
+            G = ComputeGramAnnular(width, height, order, eps_lb, eps_ub, dtype)
+            X = SolveMasked(A, G, B, mask_imgs.reshape((count, height * width)))
+
+    except np.linalg.LinAlgError:
         return UNKNOWN_FAIL, None, None
 
-    # returning the solution of the SEL if any
-    return SUCCESS, x, None
+    # returning the solutions (one per row)
+    return SUCCESS, X, None
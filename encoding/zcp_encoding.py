@@ -1,30 +1,62 @@
-import cv2
 import numpy as np
 
-from encoding.fda_encoding import ComputeMfCircular
+from encoding.fda_encoding import ComputeMfCircular, ComputeGramCircular, ComputeProjectorCircular, ComputeMomentsCircular, SolveMasked, \
+    ComputeWeightsCircular, ProjectMasked
 
 from utils.error_utils import SUCCESS, UNKNOWN_FAIL
+from utils.recognition_definitions import ZERNIKE_LEAST_SQUARES, ZERNIKE_PROJECTION
 
 
-def encode_iris(norm_img, order=16):
+# if the mask is given, occluded pixels are not taken into account
+def encode_iris(norm_img, order=16, mask_img=None, method=ZERNIKE_LEAST_SQUARES, dtype=np.float64):
     # getting image dimensions
     height, width = norm_img.shape
 
-    # computing Mf matrix
-    A = ComputeMfCircular(width, height, order)
+    # encoding the image as a batch of one image
+    mask_imgs = None if mask_img is None else mask_img.reshape((1, height, width))
+    result, x, _ = encode_iris_batch(norm_img.reshape((1, height, width)), order, mask_imgs, method, dtype)
 
-    # reshaping image (as a column vector)
-    b = norm_img.reshape((height * width,))
+    # if there was an error of some kind
+    if result != SUCCESS:
+        return result, None, None
 
-    # changing datatype to float64
-    b = b.astype(np.float64)
+    # returning the solution as a column vector
+    return SUCCESS, x.reshape((order, 1)), None
 
-    # solving the corresponding SEL (Ax = b) by min squares
-    result, x = cv2.solve(src1=A, src2=b, flags=cv2.DECOMP_QR)
 
-    # if there was an error of some kind
-    if not result:
+# encodes a stack of normalized images (count x height x width) at once
+def encode_iris_batch(norm_imgs, order=16, mask_imgs=None, method=ZERNIKE_LEAST_SQUARES, dtype=np.float64):
+    # getting images dimensions
+    count, height, width = norm_imgs.shape
+
+    # reshaping images (as row vectors) and changing datatype to the working precision
+    B = norm_imgs.reshape((count, height * width)).astype(dtype)
+
+    try:
+        # computing the moments as inner products with the basis (an approximation, the codes do not
+        # match the least squares ones, see compute_moments)
+        if method == ZERNIKE_PROJECTION and mask_imgs is None:
+            M = ComputeMomentsCircular(width, height, order, dtype)
+            X = B.dot(M.T)
+
+        # computing the moments as inner products weighted by the mask (only the good pixels)
+        elif method == ZERNIKE_PROJECTION:
+            A = ComputeMfCircular(width, height, order, dtype)
+            X = ProjectMasked(A, ComputeWeightsCircular(width, height), B, mask_imgs.reshape((count, height * width)))
+
+        # solving every SEL (Ax = b) by min squares with a single product
+        elif mask_imgs is None:
+            P = ComputeProjectorCircular(width, height, order, dtype)
+            X = B.dot(P.T)
+
+        # solving every SEL (A'WAx = A'Wb) taking only the good pixels
+        else:
+            A = ComputeMfCircular(width, height, order, dtype)
+            G = ComputeGramCircular(width, height, order, dtype)
+            X = SolveMasked(A, G, B, mask_imgs.reshape((count, height * width)))
+
+    except np.linalg.LinAlgError:
         return UNKNOWN_FAIL, None, None
 
-    # returning the solution of the SEL if any
-    return SUCCESS, x, None
+    # returning the solutions (one per row)
+    return SUCCESS, X, None
@@ -1,8 +1,17 @@
-from cmath import sqrt as c_sqrt
 from math import factorial as fact
 from math import sqrt, ceil, cos, sin
 
+import numpy as np
+
 import fda.zernike_circular_polynomial as zern_circ
+from fda.zernike_radial_polynomial import RadialTable
+
+# ----------------------------------------------------------------------------------
+
+# tables of the coefficients of the Q polynomials, indexed by eps (see GetAnnularTables)
+annular_tables = {}
+
+# ----------------------------------------------------------------------------------
 
 
 #ToDo: Python code here. Optimize it with cython or anything like that.
@@ -28,45 +37,86 @@ def c_Rmn(m, n, rho):
     return value
 
 
-#ToDo: Python code here. Optimize it with cython or anything like that.
+# Q(m, j, u, eps) is a polynomial of degree j in u, and it is stored as its coefficients
+# in the basis Q(0, i, u, eps), 0 <= i <= j (these are radial polynomials R_2i^0 of
+# (u - eps^2) / (1 - eps^2), evaluated with the stable recurrence of RadialTable). The
+# coefficients and the values of h and Q(., ., 0, eps) do not depend on u, so they are
+# computed once and stored in tables per eps.
+def GetAnnularTables(eps):
+    if eps not in annular_tables:
+        # (values of h, values of Q(., ., 0, eps), coefficients of Q)
+        annular_tables[eps] = ({}, {}, {})
+
+    return annular_tables[eps]
+
+
 def h(m, j, eps):
-    if m == 0:
-        return (1 - pow(eps, 2)) / (2 * (2 * j + 1))
+    h_table, _, _ = GetAnnularTables(eps)
 
-    num = 2 * (2 * j + 2 * m - 1) * Q(m - 1, j + 1, 0, eps) * h(m - 1, j, eps)
-    den = (j + m) * (1 - pow(eps, 2)) * Q(m - 1, j, 0, eps)
+    if (m, j) not in h_table:
+        if m == 0:
+            h_table[(m, j)] = (1 - pow(eps, 2)) / (2 * (2 * j + 1))
+        else:
+            num = 2 * (2 * j + 2 * m - 1) * Q0(m - 1, j + 1, eps) * h(m - 1, j, eps)
+            den = (j + m) * (1 - pow(eps, 2)) * Q0(m - 1, j, eps)
 
-    return -(num / den)
+            h_table[(m, j)] = -(num / den)
 
+    return h_table[(m, j)]
 
-#ToDo: Refactor code because it is written for debug purposes
-#ToDo: Python code here. Optimize it with cython or anything like that.
-def Q(m, j, u, eps):
-    if m == 0:
-        new_rho = c_sqrt((u - pow(eps, 2)) / (1 - pow(eps, 2)))
-        return c_Rmn(0, 2 * j, new_rho)
 
-    h_val = h(m - 1, j, eps)
-    q_val = Q(m - 1, j, 0, eps)
+# value of Q(m, j, 0, eps)
+def Q0(m, j, eps):
+    _, q0_table, _ = GetAnnularTables(eps)
+
+    if (m, j) not in q0_table:
+        # u = 0 is inside the pupil, so the argument of R_2i^0 is imaginary
+        u_2 = -pow(eps, 2) / (1 - pow(eps, 2))
+        basis = Q0Basis(j, np.array([u_2]))
+
+        q0_table[(m, j)] = float(QCoefficients(m, j, eps).dot(basis))
+
+    return q0_table[(m, j)]
 
-    num = 2 * (2 * j + 2 * m - 1) * h_val
-    den = (j + m) * (1 - pow(eps, 2)) * q_val
 
-    result = num / den
+# coefficients of Q(m, j, u, eps) in the basis Q(0, i, u, eps), 0 <= i <= j
+def QCoefficients(m, j, eps):
+    _, _, coefficients_table = GetAnnularTables(eps)
 
-    cum_sum = 0.0
-    i = 0
-    while i <= j:
-        q_val_1 = Q(m - 1, i, 0, eps)
-        q_val_2 = Q(m - 1, i, u, eps)
+    if (m, j) not in coefficients_table:
+        coefficients = np.zeros(j + 1, np.float64)
 
-        h_val_1 = h(m - 1, i, eps)
+        if m == 0:
+            coefficients[j] = 1.0
+        else:
+            num = 2 * (2 * j + 2 * m - 1) * h(m - 1, j, eps)
+            den = (j + m) * (1 - pow(eps, 2)) * Q0(m - 1, j, eps)
 
-        cum_sum += (q_val_1 * q_val_2) / h_val_1
+            result = num / den
 
-        i += 1
+            for i in range(j + 1):
+                weight = Q0(m - 1, i, eps) / h(m - 1, i, eps)
+                coefficients[:i + 1] += weight * QCoefficients(m - 1, i, eps)
 
-    return result * cum_sum
+            coefficients *= result
+
+        coefficients_table[(m, j)] = coefficients
+
+    return coefficients_table[(m, j)]
+
+
+# values of Q(0, i, u, eps), 0 <= i <= j (as rows), given the values (u - eps^2) / (1 - eps^2)
+def Q0Basis(j, u_2):
+    table = RadialTable([(2 * j, 0)], None, u_2)
+    return np.array([table[(2 * i, 0)] for i in range(j + 1)])
+
+
+#ToDo: Refactor code because it is written for debug purposes
+def Q(m, j, u, eps):
+    if u == 0:
+        return Q0(m, j, eps)
+
+    return float(QVector(m, j, np.array([u], np.float64), eps)[0])
 
 
 #ToDo: Refactor code because it is written for debug purposes
@@ -135,3 +185,70 @@ def ZernikeAnnularDouble(n, m, rho, theta, eps_lb, eps_ub):
 
     #returning zernike circular polynomial evaluation
     return nnm * rnm * azim
+
+
+# same as Q, but evaluated over an array of u values
+def QVector(m, j, u, eps):
+    u_2 = (u - pow(eps, 2)) / (1 - pow(eps, 2))
+    return np.tensordot(QCoefficients(m, j, eps), Q0Basis(j, u_2), axes=1)
+
+
+# same as Rmn, but evaluated over an array of rho values
+def RmnVector(m, n, rho, eps):
+    rho = np.asarray(rho, np.float64)
+
+    # case:	eps = 0
+    if eps == 0:
+        return zern_circ.RmnVector(m, n, rho)
+
+    # Rnm uses the absolute value of m
+    m = abs(m)
+
+    # case: m = 0 and n even (radii inside the pupil are not valid)
+    if m == 0 and n % 2 == 0:
+        num = np.maximum(rho * rho - pow(eps, 2), 0.0)
+        den = (1 - pow(eps, 2))
+
+        new_rho = np.sqrt(num / den)
+        return zern_circ.RmnVector(0, n, new_rho)
+
+    # case: n = m
+    if n == m:
+        cum_sum = sum(pow(eps, 2 * i) for i in range(n + 1))
+        return rho ** n / sqrt(cum_sum)
+
+    # general case
+    j = (n - m) // 2
+    u = rho * rho
+
+    q_val = QVector(m, j, u, eps)
+    h_val = h(m, j, eps)
+
+    rad = (1 - pow(eps, 2)) / (2 * (2 * j + m + 1) * h_val)
+
+    return sqrt(rad) * rho ** m * q_val
+
+
+def ZernikeAnnularSingleVector(j, rho, theta, eps_lb, eps_ub):
+    n = int(ceil((-3 + sqrt(9 + 8 * j)) / 2))
+    m = 2 * j - n * (n + 2)
+
+    return ZernikeAnnularDoubleVector(n, m, rho, theta, eps_lb, eps_ub)
+
+
+# same as ZernikeAnnularDouble, but rho and theta are arrays (they are broadcasted)
+def ZernikeAnnularDoubleVector(n, m, rho, theta, eps_lb, eps_ub):
+    rho = np.asarray(rho, np.float64)
+
+    # computing normalization constant
+    nnm = zern_circ.Nnm(n, m)
+
+    # computing radial and azimuthal contributions
+    rnm = RmnVector(m, n, rho, eps_lb)
+    azim = zern_circ.AzimuthalVector(m, theta)
+
+    # points outside the annulus are 0
+    inside = (rho >= eps_lb) & (rho <= eps_ub)
+
+    #returning zernike annular polynomial evaluation
+    return np.where(inside, nnm * rnm * azim, 0.0)
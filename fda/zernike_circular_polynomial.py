@@ -1,6 +1,10 @@
 from math import sqrt, ceil, cos, sin
 from math import factorial as fact
 
+import numpy as np
+
+from fda.zernike_radial_polynomial import RmnKernel, SingleToDouble
+
 
 #ToDo: Python code here. Optimize it with cython or anything like that.
 def Nnm(n, m):
@@ -50,3 +54,39 @@ def ZernikeCircularDouble(n, m, rho, theta):
 
     #returning zernike circular polynomial evaluation
     return nnm * rnm * azim
+
+
+# same as Rmn, but evaluated over an array of rho values
+def RmnVector(m, n, rho):
+    return RmnKernel(m, n, rho)
+
+
+# evaluates the azimuthal contribution over an array of theta values
+def AzimuthalVector(m, theta):
+    theta = np.asarray(theta, np.float64)
+    return np.cos(m * theta) if m >= 0 else -np.sin(m * theta)
+
+
+def ZernikeCircularSingleVector(j, rho, theta, rnm=None):
+    n, m = SingleToDouble(j)
+    return ZernikeCircularDoubleVector(n, m, rho, theta, rnm)
+
+
+# same as ZernikeCircularDouble, but rho and theta are arrays (they are broadcasted). The
+# radial contribution can be given if already computed (see RadialTable)
+def ZernikeCircularDoubleVector(n, m, rho, theta, rnm=None):
+    rho = np.asarray(rho, np.float64)
+
+    # computing normalization factor
+    nnm = Nnm(n, m)
+
+    # computing radial and azimuthal contributions
+    if rnm is None:
+        rnm = RmnVector(m, n, rho)
+    azim = AzimuthalVector(m, theta)
+
+    # points outside the unit disk are 0
+    inside = (rho >= 0) & (rho <= 1)
+
+    #returning zernike circular polynomial evaluation
+    return np.where(inside, nnm * rnm * azim, 0.0)
@@ -0,0 +1,63 @@
+from math import sqrt, ceil
+
+import numpy as np
+
+
+# returns the (n, m) indices of the zernike polynomial with single index j
+def SingleToDouble(j):
+    n = int(ceil((-3 + sqrt(9 + 8 * j)) / 2))
+    m = 2 * j - n * (n + 2)
+    return n, m
+
+
+# Evaluates the radial polynomials R_n^m of all the given (n, m) pairs over an array of
+# rho values. For each m, the polynomials are built with Kintner's three-term recurrence
+# in n (starting at R_m^m and R_(m+2)^m), so every lower order result is reused and the
+# evaluation is stable even for high orders (unlike the explicit factorial sum).
+#
+# Returns a dict indexed by (n, |m|). When only m = 0 is needed, rho_2 (rho squared) can be
+# given instead of rho, and it may be negative (rho imaginary).
+def RadialTable(pairs, rho, rho_2=None):
+    if rho_2 is None:
+        rho = np.asarray(rho, np.float64)
+        rho_2 = rho * rho
+    else:
+        rho_2 = np.asarray(rho_2, np.float64)
+
+    # maximum n needed for each m
+    max_n = {}
+    for n, m in pairs:
+        m = abs(m)
+        if n >= m and (n - m) % 2 == 0:
+            max_n[m] = max(n, max_n.get(m, m))
+
+    table = {}
+    for m, ub_n in max_n.items():
+        # base cases: R_m^m = rho^m and R_(m+2)^m = (m + 2)rho^(m+2) - (m + 1)rho^m
+        r_m = rho ** m if m > 0 else np.ones(rho_2.shape, np.float64)
+        table[(m, m)] = r_m
+
+        if ub_n >= m + 2:
+            table[(m + 2, m)] = ((m + 2) * rho_2 - (m + 1)) * r_m
+
+        # R_p^m from R_(p-2)^m and R_(p-4)^m
+        for p in range(m + 4, ub_n + 1, 2):
+            k1 = (p + m) * (p - m) * (p - 2) / 2.0
+            k2 = 2.0 * p * (p - 1) * (p - 2)
+            k3 = -m * m * (p - 1) - p * (p - 1) * (p - 2)
+            k4 = -p * (p + m - 2) * (p - m - 2) / 2.0
+
+            table[(p, m)] = ((k2 * rho_2 + k3) * table[(p - 2, m)] + k4 * table[(p - 4, m)]) / k1
+
+    return table
+
+
+# evaluates a single radial polynomial R_n^m over an array of rho values
+def RmnKernel(m, n, rho):
+    m = abs(m)
+
+    # R_n^m is 0 if n - m is odd or m > n
+    if n < m or (n - m) % 2 != 0:
+        return np.zeros(np.shape(rho), np.float64)
+
+    return RadialTable([(n, m)], rho)[(n, m)]
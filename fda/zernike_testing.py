@@ -1,11 +1,10 @@
-from math import ceil, sqrt, atan2
 import numpy as np
-from zernike_annular_polynomial import ZernikeAnnularDouble as ZernikeAnnular
+from fda.zernike_annular_polynomial import ZernikeAnnularDoubleVector as ZernikeAnnular
+from fda.zernike_radial_polynomial import SingleToDouble
 
 
 def FillGridSingle(j, diameter, eps_lb, eps_ub):
-    n = int(ceil((-3 + sqrt(9 + 8 * j)) / 2))
-    m = 2 * j - n * (n + 2)
+    n, m = SingleToDouble(j)
 
     return FillGridDouble(n, m, diameter, eps_lb, eps_ub)
 
@@ -18,21 +17,16 @@ def FillGridDouble(n, m, diameter, eps_lb, eps_ub):
     # computing radius
     radius = diameter / 2.0
 
-    # creating the grid
-    grid = np.empty((diameter, diameter), np.float64)
+    # normalizing grid coordinates in [-1; 1]
+    X = (np.arange(diameter) - radius) / radius
+    Y = (radius - np.arange(diameter).reshape((diameter, 1))) / radius
 
-    for i in range(diameter):
-        for j in range(diameter):
-            X = (j - radius) / radius   # normalizing grid coordinates in [-1; 1]
-            Y = (radius - i) / radius   # normalizing grid coordinates in [-1; 1]
+    # computing rho and theta
+    rho = np.sqrt(X * X + Y * Y)
+    theta = np.arctan2(Y, X)
 
-            # computing rho
-            rho = sqrt(pow(X, 2) + pow(Y, 2))
-
-            # computing theta
-            theta = atan2(Y, X)
-
-            grid[i, j] = ZernikeAnnular(n, m, rho, theta, eps_lb, eps_ub)
+    # evaluating the polynomial in the whole grid
+    grid = ZernikeAnnular(n, m, rho, theta, eps_lb, eps_ub)
 
     # returning the computed grid
     return grid
@@ -53,17 +47,16 @@ def norm_img(img, diameter, eps_lb, eps_ub):
 
     result = np.empty((height, width), np.uint8)
 
-    for i in range(height):
-        for j in range(width):
-            X = (j - radius) / radius   # normalizing grid coordinates in [-1; 1]
-            Y = (radius - i) / radius   # normalizing grid coordinates in [-1; 1]
+    # normalizing grid coordinates in [-1; 1]
+    X = (np.arange(width) - radius) / radius
+    Y = (radius - np.arange(height).reshape((height, 1))) / radius
 
-            # computing rho
-            rho = sqrt(pow(X, 2) + pow(Y, 2))
+    # computing rho
+    rho = np.sqrt(X * X + Y * Y)
 
-            if rho < eps_lb or rho > eps_ub:
-                result[i, j] = 200
-            else:
-                result[i, j] = int(img[i, j])
+    # points outside the annulus are gray
+    outside = (rho < eps_lb) | (rho > eps_ub)
+    result[:] = img
+    result[outside] = 200
 
     return result
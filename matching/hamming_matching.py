@@ -16,4 +16,21 @@ def hamming_distance(bit_code_x, mask_x, bit_code_y, mask_y):
     result = np.bitwise_and(xor_result, and_result)
 
     # counting disagreeing bits and normalizing
-    return np.count_nonzero(result) / float(code_size)
\ No newline at end of file
+    return np.count_nonzero(result) / float(code_size)
+
+
+# amount of bits set in every possible byte
+BITS_COUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+
+# hamming distance with masks for bit codes packed in bytes (see np.packbits)
+def packed_hamming_distance(bit_code_x, mask_x, bit_code_y, mask_y, code_size=None):
+    # getting code size in bits (assuming all have the same size)
+    if code_size is None:
+        code_size = 8 * len(bit_code_x)
+
+    # disagreeing bits that are valid in both masks
+    result = np.bitwise_and(np.bitwise_xor(bit_code_x, bit_code_y), np.bitwise_and(mask_x, mask_y))
+
+    # counting disagreeing bits and normalizing
+    return BITS_COUNT_TABLE[result].sum() / float(code_size)
@@ -1,10 +1,12 @@
 import cv2
 import numpy as np
 
-from math import pi, sin, cos
-from utils.math_utils import is_between_parabolas_coords
-from utils.image_utils import valid_pixel
+from math import pi
+from utils.math_utils import between_parabolas_mask
+from utils.image_utils import sample_pixels
 from utils.error_utils import SUCCESS
+from utils.iris_data_definitions import normalization_params
+from utils.recognition_definitions import NEAREST_INTERPOLATION
 #--------------------------------------------------------------------------------
 
 ANGULAR_RESOLUTION = 256    # default angular resolution
@@ -13,62 +15,93 @@ RADIAL_RESOLUTION = 64      # default radial resolution
 THRESHOLD_SPECULAR = 220
 THRESHOLD_BLACK_BIT = 40    # this is usually the pupil threshold
 
+# unit polar grids already computed, indexed by (angles, radii)
+sampling_grids = {}
+
 #--------------------------------------------------------------------------------
 
 
 #Assumes that the pupil and iris are concentric, and uses only the pupil center
-def normalize_iris(img, angular_resolution, radial_resolution, pupil_center, pupil_radius, iris_center, iris_radius, upper_eyelid, lower_eyelid):
+def normalize_iris(img, angular_resolution, radial_resolution, pupil_center, pupil_radius, iris_center, iris_radius, upper_eyelid, lower_eyelid, interpolation=NEAREST_INTERPOLATION):
+    # normalizing the image as a batch of one image
+    params = normalization_params(pupil_center, pupil_radius, iris_center, iris_radius, upper_eyelid, lower_eyelid)
+    result, norm_images, mask_images = normalize_iris_batch([img], angular_resolution, radial_resolution, params.reshape((1,)), interpolation)
+
+    #returning the unwrapped image and the corresponding mask
+    return result, norm_images[0], mask_images[0]
+
+
+# Normalizes a list of eye images with their normalization parameters (a structured array of
+# NORMALIZATION_PARAMS_DTYPE), returns the stacked images and masks (count x radii x angles)
+def normalize_iris_batch(imgs, angular_resolution, radial_resolution, params, interpolation=NEAREST_INTERPOLATION):
     angles = angular_resolution                 # amount of angles to map (<= 360)
     radii = radial_resolution                   # amount of radius samples
-    r_annular = int(iris_radius - pupil_radius)  # iris width (the width of the iris ring)
+    count = len(imgs)
+
+    # getting the parameters of every image (as count x 1 x 1 arrays)
+    xp = params["pupil_center"][:, 0].reshape((count, 1, 1))     # (xp, yp) is the pupil center
+    yp = params["pupil_center"][:, 1].reshape((count, 1, 1))
+    pupil_radius = params["pupil_radius"].reshape((count, 1, 1))
+    r_annular = np.trunc(params["iris_radius"].reshape((count, 1, 1)) - pupil_radius)   # iris width (the width of the iris ring)
+
+    # getting the unit polar grid of this resolution (shared by every image)
+    cos_theta, sin_theta, steps = get_sampling_grid(angles, radii)
 
+    # scaling and translating the grid to the iris ring of every image
+    r = pupil_radius + r_annular * steps
+    x = xp + r * cos_theta
+    y = yp - r * sin_theta  # -r*sin(theta) => anticlockwise radial selection
+
+    # creating the normalized images
+    norm_images = np.empty((count, radii, angles), np.uint8)
+    mask_images = np.empty((count, radii, angles), np.uint8)     # 1 if valid pixel, 0 otherwise
+
+    for k in range(count):
+        norm_images[k], mask_images[k] = sample_iris(imgs[k], x[k], y[k], params["upper_eyelid"][k], params["lower_eyelid"][k], interpolation)
+
+    #returning the unwrapped images and the corresponding masks
+    return SUCCESS, norm_images, mask_images
+
+
+# samples the eye image at the given coordinates, returns the normalized image and its mask
+def sample_iris(img, x, y, upper_eyelid, lower_eyelid, interpolation):
     img_height = img.shape[0]   # getting the image height
-    xp, yp = pupil_center       # (xp, yp) is the pupil center
 
-    # creating the normalized image
-    norm_image = np.empty((radii, angles), np.uint8)
-    mask_image = np.empty((radii, angles), np.uint8)     # 1 if valid pixel, 0 otherwise
+    # getting the pixel values (indexed first by rows, then by columns)
+    norm_image, valid = sample_pixels(img, x, y, interpolation)
 
-    #ToDo: Python code here. Optimize it with cython or anything like that.
-    #foreach angle
-    for col in range(angles):
-        #computing the current angle
-        theta = col * (2 * pi) / angles     # simple "three rule" (for the cubans)
-        cos_theta = cos(theta)
-        sin_theta = sin(theta)
+    # a pixel is good if it is inside the image, is not a black bit, is not a specular
+    # reflection and belongs inside the two parabolas
+    mask_image = valid & \
+        (norm_image >= THRESHOLD_BLACK_BIT) & \
+        (norm_image <= THRESHOLD_SPECULAR) & \
+        between_parabolas_mask(upper_eyelid, lower_eyelid, x, img_height - y)
 
-        #foreach radius
-        for row in range(radii):
-            #getting pixel location in the original image
-            r = pupil_radius + r_annular * row / (radii - 1)
-            x = xp + r * cos_theta
-            y = yp - r * sin_theta  # -r*sin(theta) => anticlockwise radial selection
+    return norm_image, mask_image
 
-            #getting the pixel value
-            pixel_value = img.item(y, x)    # indexed first by rows, then by columns
 
-            # If pixel out of bounds
-            if not valid_pixel(img, x, y):
-                mask_image.itemset(row, col, 0)
+# Returns the polar grid of radius 1 for the given resolution: cos(theta) and sin(theta) of
+# every angle (as row vectors) and the radial steps from 0 to 1 (as a column vector). It
+# only depends on the resolution, so it is computed once
+def get_sampling_grid(angles, radii):
+    key = (angles, radii)
 
-            # If pixel is a black bit
-            elif pixel_value < THRESHOLD_BLACK_BIT:
-                mask_image.itemset(row, col, 0)
+    # if already computed, then return it
+    if key in sampling_grids:
+        return sampling_grids[key]
 
-            # If pixel is a specular reflection
-            elif pixel_value > THRESHOLD_SPECULAR:
-                mask_image.itemset(row, col, 0)
+    # computing the angles
+    theta = np.arange(angles, dtype=np.float64).reshape((1, angles)) * (2 * pi) / angles     # simple "three rule" (for the cubans)
 
-            # If pixel doesn't belong inside the two parabolas
-            elif not is_between_parabolas_coords(upper_eyelid, lower_eyelid, x, img_height - y):
-                mask_image.itemset(row, col, 0)
+    # computing the radial steps
+    steps = np.arange(radii, dtype=np.float64).reshape((radii, 1)) / (radii - 1)
 
-            # Everything is OK
-            else:
-                mask_image.itemset(row, col, 1)
+    grid = (np.cos(theta), np.sin(theta), steps)
 
-            #setting the pixel in the normalized iris image
-            norm_image.itemset(row, col, pixel_value)
+    # the grid is shared by every normalization, so nobody should modify it
+    for arr in grid:
+        arr.flags.writeable = False
 
-    #returning the unwrapped image and the corresponding mask
-    return SUCCESS, norm_image , mask_image
\ No newline at end of file
+    sampling_grids[key] = grid
+
+    return grid
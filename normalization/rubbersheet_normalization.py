@@ -1,10 +1,12 @@
 import cv2
 import numpy as np
 
-from math import pi, sin, cos, atan, sqrt
-from utils.math_utils import is_between_parabolas_coords
-from utils.image_utils import valid_pixel
+from math import pi
+from utils.math_utils import between_parabolas_mask
+from utils.image_utils import sample_pixels
 from utils.error_utils import SUCCESS
+from utils.iris_data_definitions import normalization_params
+from utils.recognition_definitions import NEAREST_INTERPOLATION
 
 #--------------------------------------------------------------------------------
 
@@ -14,93 +16,131 @@ RADIAL_RESOLUTION = 64      # default radial resolution
 THRESHOLD_SPECULAR = 220
 THRESHOLD_BLACK_BIT = 40    # this is usually the pupil threshold
 
+# angles and radial samples already computed, indexed by (angles, radii)
+sampling_grids = {}
+
 #--------------------------------------------------------------------------------
 
 
 # The pupil and iris might not be concentric
-def normalize_iris(img, angular_resolution, radial_resolution, pupil_center, pupil_radius, iris_center, iris_radius, upper_eyelid, lower_eyelid):
+def normalize_iris(img, angular_resolution, radial_resolution, pupil_center, pupil_radius, iris_center, iris_radius, upper_eyelid, lower_eyelid, interpolation=NEAREST_INTERPOLATION):
+    # normalizing the image as a batch of one image
+    params = normalization_params(pupil_center, pupil_radius, iris_center, iris_radius, upper_eyelid, lower_eyelid)
+    result, norm_images, mask_images = normalize_iris_batch([img], angular_resolution, radial_resolution, params.reshape((1,)), interpolation)
+
+    #returning the unwrapped image and the corresponding mask
+    return result, norm_images[0], mask_images[0]
+
+
+# Normalizes a list of eye images with their normalization parameters (a structured array of
+# NORMALIZATION_PARAMS_DTYPE), returns the stacked images and masks (count x radii x angles)
+def normalize_iris_batch(imgs, angular_resolution, radial_resolution, params, interpolation=NEAREST_INTERPOLATION):
     angles = angular_resolution          # amount of angles to map (<= 360)
     radii = radial_resolution            # iris width (the width of the iris ring)
     radii2 = radii + 2                   # radial resolution plus 2
+    count = len(imgs)
 
-    img_height = img.shape[0]   # getting the image height
-    xp, yp = pupil_center       # (xp, yp) is the pupil center
-    xi, yi = iris_center        # (xi, yi) is the iris center
-    rp = pupil_radius           # rp is the radius of the pupil
-    ri = iris_radius            # ri is the radius of the iris
-
-    # creating the normalized image
-    norm_image = np.empty((radii, angles), np.uint8)
-    mask_image = np.empty((radii, angles), np.uint8)     # 1 if valid pixel, 0 otherwise
+    # getting the parameters of every image (as count x 1 x 1 arrays)
+    xp = params["pupil_center"][:, 0].reshape((count, 1, 1))     # (xp, yp) is the pupil center
+    yp = params["pupil_center"][:, 1].reshape((count, 1, 1))
+    xi = params["iris_center"][:, 0].reshape((count, 1, 1))      # (xi, yi) is the iris center
+    yi = params["iris_center"][:, 1].reshape((count, 1, 1))
+    rp = params["pupil_radius"].reshape((count, 1, 1))           # rp is the radius of the pupil
+    ri = params["iris_radius"].reshape((count, 1, 1))            # ri is the radius of the iris
 
     # computing centers offset
     ox = xp - xi    # offstet of pupil and iris centers in the x axis
     oy = yp - yi    # offstet of pupil and iris centers in the y axis
 
-    if ox < 0:
-        sgn = -1
-        phi = atan(oy / ox)
-    elif ox > 0:
-        sgn = 1
-        phi = atan(oy / ox)
-    else:
-        sgn = 1 if oy > 0 else -1
-        phi = pi / 2.0
+    # the sign of ox (or the one of oy if ox is 0) and the angle of the offset
+    sgn = np.where(ox != 0, np.sign(ox), np.where(oy > 0, 1.0, -1.0))
+    phi = np.arctan(np.divide(oy, ox, out=np.zeros_like(oy), where=ox != 0))
+    phi[ox == 0] = pi / 2.0
 
     #computing alpha
     alpha = ox * ox + oy * oy
 
-    #ToDo: Python code here. Optimize it with cython or anything like that.
-    #foreach angle
-    for col in range(angles):
-        # computing the current angle
-        theta = col * (2 * pi) / (angles - 1)       # simple "three rule" (for the cubans)
-        cos_theta = cos(theta)
-        sin_theta = sin(theta)
+    # getting the angles and the radial samples of this resolution (shared by every image)
+    theta, cos_theta, sin_theta, rows = get_sampling_grid(angles, radii)
 
-        # computing beta
-        beta = sgn * cos(pi - phi - theta)
+    # computing beta
+    beta = sgn * np.cos(pi - phi - theta)
 
-        # computing the radius of the iris ring for angle theta (see Libor Masek's thesis)
-        r_prime = sqrt(alpha) * beta + sqrt(alpha * beta * beta - (alpha - ri * ri))
-        r_prime -= rp
+    # computing the radius of the iris ring for every angle theta (see Libor Masek's thesis)
+    with np.errstate(invalid="ignore"):
+        r_prime = np.sqrt(alpha) * beta + np.sqrt(alpha * beta * beta - (alpha - ri * ri))
+    r_prime -= rp
 
-        #foreach radius
-        for row in range(radii2):
-            # computing radius from pupil center to the current sampled point
-            r = rp + r_prime * row / (radii2 - 1)
+    # computing radius from pupil center to every sampled point
+    r = rp + r_prime * rows / (radii2 - 1)
 
-            #excluding the first and last rows (pupil/iris border and iris/sclera border)
-            if 0 < row < radii2 - 1:
-                #getting pixel location in the original image
-                x = int(xp + r * cos_theta)
-                y = int(yp - r * sin_theta)
+    # getting the pixel locations in the original images
+    x = xp + r * cos_theta
+    y = yp - r * sin_theta
 
-                #getting the pixel value
-                pixel_value = img.item(y, x)    # indexed first by rows, then by columns
+    # if the iris ring is not defined for some angle, the pixels are out of bounds
+    defined = np.isfinite(x) & np.isfinite(y)
+    x = np.where(defined, x, -1)
+    y = np.where(defined, y, -1)
 
-                # If pixel out of bounds
-                if not valid_pixel(img, x, y):
-                    mask_image.itemset(row - 1, col, 0)
+    # the nearest pixel locations are truncated as int does
+    if interpolation == NEAREST_INTERPOLATION:
+        x = np.trunc(x)
+        y = np.trunc(y)
 
-                # If pixel is a black bit
-                elif pixel_value < THRESHOLD_BLACK_BIT:
-                    mask_image.itemset(row - 1, col, 0)
+    # creating the normalized images
+    norm_images = np.empty((count, radii, angles), np.uint8)
+    mask_images = np.empty((count, radii, angles), np.uint8)     # 1 if valid pixel, 0 otherwise
 
-                # If pixel is a specular reflection
-                elif pixel_value > THRESHOLD_SPECULAR:
-                    mask_image.itemset(row - 1, col, 0)
+    for k in range(count):
+        norm_image, mask_image = sample_iris(imgs[k], x[k], y[k], params["upper_eyelid"][k], params["lower_eyelid"][k], interpolation)
+        norm_images[k] = norm_image
+        mask_images[k] = mask_image & defined[k]
 
-                # If pixel doesn't belong inside the two parabolas
-                elif not is_between_parabolas_coords(upper_eyelid, lower_eyelid, x, img_height - y):
-                    mask_image.itemset(row - 1, col, 0)
+    #returning the unwrapped images and the corresponding masks
+    return SUCCESS, norm_images, mask_images
 
-                # Everything is OK
-                else:
-                    mask_image.itemset(row - 1, col, 1)
 
-                #setting the pixel in the normalized iris image
-                norm_image.itemset(row - 1, col, pixel_value)
+# samples the eye image at the given coordinates, returns the normalized image and its mask
+def sample_iris(img, x, y, upper_eyelid, lower_eyelid, interpolation):
+    img_height = img.shape[0]   # getting the image height
 
-    #returning the unwrapped image and the corresponding mask
-    return SUCCESS, norm_image , mask_image
\ No newline at end of file
+    # getting the pixel values (indexed first by rows, then by columns)
+    norm_image, valid = sample_pixels(img, x, y, interpolation)
+
+    # a pixel is good if it is inside the image, is not a black bit, is not a specular
+    # reflection and belongs inside the two parabolas
+    mask_image = valid & \
+        (norm_image >= THRESHOLD_BLACK_BIT) & \
+        (norm_image <= THRESHOLD_SPECULAR) & \
+        between_parabolas_mask(upper_eyelid, lower_eyelid, x, img_height - y)
+
+    return norm_image, mask_image
+
+
+# Returns the angles of the given resolution with their cosines and sines (as row vectors),
+# and the radial samples 1..radii (as a column vector). The radial samples exclude the first
+# and last rows (pupil/iris border and iris/sclera border). They only depend on the
+# resolution, so they are computed once
+def get_sampling_grid(angles, radii):
+    key = (angles, radii)
+
+    # if already computed, then return it
+    if key in sampling_grids:
+        return sampling_grids[key]
+
+    # computing the angles
+    theta = np.arange(angles, dtype=np.float64).reshape((1, angles)) * (2 * pi) / (angles - 1)  # simple "three rule" (for the cubans)
+
+    # computing the radial samples
+    rows = np.arange(1, radii + 1, dtype=np.float64).reshape((radii, 1))
+
+    grid = (theta, np.cos(theta), np.sin(theta), rows)
+
+    # the grid is shared by every normalization, so nobody should modify it
+    for arr in grid:
+        arr.flags.writeable = False
+
+    sampling_grids[key] = grid
+
+    return grid
@@ -15,6 +15,8 @@ import encoding.fourier_encoding as fou_enc
 import matching.hamming_matching as hamm_match
 import matching.lineal_algebra_matching as linalg_match
 
+import numpy as np
+
 from utils.error_utils import *
 from utils.iris_data_definitions import *
 from utils.math_utils import fit_parabola_coords
@@ -23,6 +25,12 @@ from utils.recognition_definitions import *
 
 # ----------------------------------------------------------------------------------
 
+# min curvature (|A|) of an eyelid parabola, flatter ones (a sag under 1 pixel between points
+# 50 pixels apart) are almost lines and the side kept by the mask would depend on noise
+MIN_EYELID_CURVATURE = 0.0004
+
+# ----------------------------------------------------------------------------------
+
 
 def generates_binary_template(encoding_method):
     return \
@@ -36,6 +44,28 @@ def generates_vector_template(encoding_method):
         encoding_method == ZCP_ENCODING or \
         encoding_method == ZAP_ENCODING
 
+
+# Fits the parabola of an eyelid to its three points. As in the main window, the y axis of
+# the parabolas points upwards (y = img_height - row), so the upper eyelid must open downwards
+# (A < 0) and the lower one upwards (A > 0). Returns None if the points are not valid (two of
+# them share the x coordinate) or the parabola is curved the wrong way or almost flat, since
+# the mask would keep the eyelid instead of the iris
+def get_eyelid_parabola(eyelid_data, img_height, upper):
+    p1, p2, p3 = eyelid_data
+    coeff = fit_parabola_coords(p1[X], img_height - p1[Y], p2[X], img_height - p2[Y], p3[X], img_height - p3[Y])
+
+    if coeff == (-1, -1, -1):
+        return None
+
+    curvature = -coeff[0] if upper else coeff[0]
+
+    return coeff if curvature >= MIN_EYELID_CURVATURE else None
+
+
+# numpy type of the (real) numbers used in the given precision
+def get_precision_dtype(precision):
+    return np.float32 if precision == SINGLE_PRECISION else np.float64
+
 # ----------------------------------------------------------------------------------
 
 
@@ -47,12 +77,18 @@ class RecognitionAlgorithm(object):
     # iris segmentation function
     segment_iris_func = None
 
+    # circle hough transform used by the project iris segmentation (accumulator or opencv)
+    hough_backend = HOUGH_ACCUMULATOR
+
     #iris normalization method
     normalize_iris_method = None
 
     # iris normalization function
     normalize_iris_func = None
 
+    # iris normalization function of a list of images
+    normalize_iris_batch_func = None
+
     # angular resolution in the normalization process
     angles = 180
 
@@ -74,6 +110,23 @@ class RecognitionAlgorithm(object):
     # external epsilon (for annular polynomial)
     external_eps = 1.0
 
+    # determines whether occluded pixels are left out of the zernike encodings or not
+    masked_encoding = False
+
+    # method used to compute the zernike moments (least squares or orthogonal projection)
+    zernike_method = ZERNIKE_LEAST_SQUARES
+
+    # determines whether the pixels occluded by the eyelids are masked out in the normalization
+    # (off by default, on the sample images it lowers the impostor distances more than the
+    # genuine ones)
+    eyelids_masking = False
+
+    # interpolation of the image in the normalization process (nearest or bilinear)
+    interpolation = NEAREST_INTERPOLATION
+
+    # precision of the encodings (fft, projections) and so of the distances between templates
+    precision = DOUBLE_PRECISION
+
     # template matching method
     template_matching_method = None
 
@@ -118,15 +171,24 @@ class RecognitionAlgorithm(object):
 
         self.segment_iris_method = method
 
+    def get_hough_backend(self):
+        return self.hough_backend
+
+    def set_hough_backend(self, backend):
+        if backend == HOUGH_ACCUMULATOR or backend == HOUGH_OPENCV:
+            self.hough_backend = backend
+
     def get_normalization_method(self):
         return self.normalize_iris_method
 
     def set_normalization_method(self, method):
         if method == PROJECT_IRIS_NORMALIZATION:
             self.normalize_iris_func = proj_iris_norm.normalize_iris
+            self.normalize_iris_batch_func = proj_iris_norm.normalize_iris_batch
 
         elif method == RUBBERSHEET_NORMALIZATION:
             self.normalize_iris_func = rubb_sheet_norm.normalize_iris
+            self.normalize_iris_batch_func = rubb_sheet_norm.normalize_iris_batch
 
         else:
             return
@@ -212,6 +274,39 @@ class RecognitionAlgorithm(object):
         if 0 <= eps_ext <= 1.0 and eps_ext >= self.internal_eps:
             self.external_eps = eps_ext
 
+    def get_masked_encoding(self):
+        return self.masked_encoding
+
+    def set_masked_encoding(self, masked):
+        self.masked_encoding = bool(masked)
+
+    def get_zernike_method(self):
+        return self.zernike_method
+
+    def set_zernike_method(self, method):
+        if method == ZERNIKE_LEAST_SQUARES or method == ZERNIKE_PROJECTION:
+            self.zernike_method = method
+
+    def get_eyelids_masking(self):
+        return self.eyelids_masking
+
+    def set_eyelids_masking(self, masking):
+        self.eyelids_masking = bool(masking)
+
+    def get_interpolation(self):
+        return self.interpolation
+
+    def set_interpolation(self, interpolation):
+        if interpolation == NEAREST_INTERPOLATION or interpolation == BILINEAR_INTERPOLATION:
+            self.interpolation = interpolation
+
+    def get_precision(self):
+        return self.precision
+
+    def set_precision(self, precision):
+        if precision == DOUBLE_PRECISION or precision == SINGLE_PRECISION:
+            self.precision = precision
+
     # ----------------------------------------------------------------------------
 
     def match(self, original, query):
@@ -247,12 +342,34 @@ class RecognitionAlgorithm(object):
 
     def get_template(self, eye_img):
         # ---------------segmenting iris---------------
-        result, data = self.segment_iris_func(eye_img)
+        result, data = self.segment(eye_img)
 
         # if there was a segmentation error
         if result != SUCCESS:
             return result, None, None
 
+        # ---------------normalize iris---------------
+
+        params = self.get_normalization_params(eye_img, data)
+        result, norm_images, mask_images = self.normalize_batch([eye_img], params.reshape((1,)))
+
+        # if there was a normalization error
+        if result != SUCCESS:
+            return result, None, None
+
+        # ---------------encode iris---------------
+
+        return self.__encode(norm_images[0], mask_images[0], self.angles, self.radii)
+
+    def segment(self, eye_img):
+        if self.segment_iris_method == PROJECT_IRIS_SEGMENTATION:
+            return self.segment_iris_func(eye_img, self.hough_backend)
+
+        return self.segment_iris_func(eye_img)
+
+    # returns the normalization parameters (a record of NORMALIZATION_PARAMS_DTYPE) of an eye
+    # image from its segmentation data
+    def get_normalization_params(self, eye_img, data):
         # getting segmentation data
         pupil_data = data[PUPIL_DATA]
         iris_data = data[IRIS_DATA]
@@ -264,59 +381,97 @@ class RecognitionAlgorithm(object):
         iris_center = iris_data[CENTER]
         iris_radius = iris_data[RADIUS]
 
-        #ToDo: Take eyelids in consideration
+        # getting eyelids data (the normalizers mask out the pixels outside the parabolas)
         upper_coeff = None
         lower_coeff = None
-        # # getting eyelids data
-        # upper_eyelid_data, lower_eyelid_data = eyelids_data
-        # p1, p2, p3 = upper_eyelid_data
-        # p4, p5, p6 = lower_eyelid_data
-        # upper_coeff = fit_parabola_coords(p1[X], p1[Y], p2[X], p2[Y], p3[X], p3[Y])
-        # lower_coeff = fit_parabola_coords(p4[X], p4[Y], p5[X], p5[Y], p6[X], p6[Y])
+        if self.eyelids_masking and eyelids_data is not None:
+            img_height = eye_img.shape[0]
+            upper_eyelid_data, lower_eyelid_data = eyelids_data
+            upper_coeff = get_eyelid_parabola(upper_eyelid_data, img_height, True)
+            lower_coeff = get_eyelid_parabola(lower_eyelid_data, img_height, False)
 
-        # ---------------normalize iris---------------
-
-        angles = self.angles
-        radii = self.radii
-
-        result, norm_image, mask_image = self.normalize_iris_func(eye_img, angles, radii, pupil_center, pupil_radius, iris_center, iris_radius, upper_coeff, lower_coeff)
-
-        # if there was a normalization error
-        if result != SUCCESS:
-            return result, None, None
+        return normalization_params(pupil_center, pupil_radius, iris_center, iris_radius, upper_coeff, lower_coeff)
 
-        # ---------------encode iris---------------
-
-        return self.__encode(norm_image, mask_image, angles, radii)
+    # normalizes a list of eye images with their normalization parameters (a structured array
+    # of NORMALIZATION_PARAMS_DTYPE). The stacked images and masks (count x radii x angles)
+    # can be encoded with encode_batch
+    def normalize_batch(self, eye_imgs, params):
+        return self.normalize_iris_batch_func(eye_imgs, self.angles, self.radii, params, self.interpolation)
 
     def encode(self, norm_imag, norm_mask):
+        # the mask must cover the whole normalized image
         if norm_imag.shape != norm_mask.shape:
-            return None, None
+            return WRONG_IMAGE_FORMAT, None, None
 
         radii, angles = norm_imag.shape
         return self.__encode(norm_imag, norm_mask, angles, radii)
 
+    # encodes a stack of normalized images (count x radii x angles) with their masks. Returns
+    # the templates and their masks stacked (one per row), the template of each image is the
+    # same one encode would return
+    def encode_batch(self, norm_images, masks):
+        # a stack of normalized images with a mask per image is expected
+        if norm_images.ndim != 3 or norm_images.shape != masks.shape:
+            return WRONG_IMAGE_FORMAT, None, None
+
+        count, radii, angles = norm_images.shape
+        dtype = get_precision_dtype(self.precision)
+
+        if self.encode_iris_method == LOG_GABOR_ENCODING:
+            return log_gab_filt_enc.encode_iris_batch(norm_images, masks, dtype)
+
+        elif self.encode_iris_method == ZCP_ENCODING:
+            masks = masks if self.masked_encoding else None
+            result, X, _ = zcp_enc.encode_iris_batch(norm_images, self.polynomial_order, masks, self.zernike_method, dtype)
+            return result, None if X is None else X.reshape((count, self.polynomial_order, 1)), None
+
+        elif self.encode_iris_method == ZAP_ENCODING:
+            result, X, _ = zap_enc.encode_iris_batch(norm_images, masks, self.polynomial_order, self.internal_eps, self.external_eps, self.masked_encoding, self.zernike_method, dtype)
+            return result, None if X is None else X.reshape((count, self.polynomial_order, 1)), None
+
+        elif self.encode_iris_method == FOURIER_ENCODING:
+            return fou_enc.encode_iris_batch(norm_images, masks, angles, radii, False, dtype)
+
+        # the encoders without a batched implementation are applied image by image
+        codes = []
+        code_masks = []
+        for k in range(count):
+            result, code, code_mask = self.__encode(norm_images[k], masks[k], angles, radii)
+
+            # if there was an error of some kind
+            if result != SUCCESS:
+                return result, None, None
+
+            codes.append(code)
+            code_masks.append(code_mask)
+
+        return SUCCESS, np.array(codes), np.array(code_masks)
+
     def __encode(self, norm_image, mask_image, angles, radii):
+        # gabor filters are applied per pixel, so they are not affected by the precision
+        dtype = get_precision_dtype(self.precision)
+
         if self.encode_iris_method == GABOR_FILTERS_ENCODING:
             return self.encode_iris_func(norm_image, mask_image, angles, radii)
 
         elif self.encode_iris_method == LOG_GABOR_ENCODING:
-            return self.encode_iris_func(norm_image, mask_image)
+            return self.encode_iris_func(norm_image, mask_image, dtype)
 
         elif self.encode_iris_method == ZCP_ENCODING:
             # getting polynomial order
             order = self.polynomial_order
-            return self.encode_iris_func(norm_image, order)
+            mask = mask_image if self.masked_encoding else None
+            return self.encode_iris_func(norm_image, order, mask, self.zernike_method, dtype)
 
         elif self.encode_iris_method == ZAP_ENCODING:
             # getting polynomial data
             order = self.polynomial_order
             eps_lb = self.internal_eps
             eps_ub = self.external_eps
-            return self.encode_iris_func(norm_image, mask_image, order, eps_lb, eps_ub)
+            return self.encode_iris_func(norm_image, mask_image, order, eps_lb, eps_ub, self.masked_encoding, self.zernike_method, dtype)
 
         elif self.encode_iris_method == FOURIER_ENCODING:
-            return self.encode_iris_func(norm_image, mask_image, angles, radii)
+            return self.encode_iris_func(norm_image, mask_image, angles, radii, False, dtype)
 
         else:
             return UNKNOWN_ENCODING_METHOD, None, None
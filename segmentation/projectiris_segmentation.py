@@ -1,8 +1,11 @@
 import cv2
 import numpy as np
 
+from math import pi, sqrt
+
 from utils.math_utils import compute_circle_center_coords, euclidean_distance_coords
 from utils.error_utils import SUCCESS, WRONG_IMAGE_FORMAT, PUPIL_DETECTION_FAILED, IRIS_DETECTION_FAILED, EYELIDS_DETECTION_FAILED
+from utils.recognition_definitions import HOUGH_ACCUMULATOR, HOUGH_OPENCV
 
 #--------------------------------------------------------------------------------
 
@@ -36,6 +39,9 @@ PUPIL_CENTER_OFFSET = 5
 #--------------------------------------------------------------------------------
 
 IRIS_RADIUS_INC = -5
+IRIS_BLUR_SIZE = 7 * KERNEL_SIZE_SCALE   # median filter applied before finding the iris edges
+IRIS_CANNY_LOW_THRESHOLD = 20            # thresholds of the canny edge detector of the iris edges
+IRIS_CANNY_HIGH_THRESHOLD = 40
 
 #--------------------------------------------------------------------------------
 
@@ -46,32 +52,129 @@ BLACK_THRESHOLD = 80
 EYELIDS_POINTS_DISTANCE = 50     # this is the distance between the eyelids points
 EYELIDS_PADDING = 21             # i have no idea what it means
 EYELID_POINTS_COUNT = 3          # amount of points of an eyelid
+
+#--------------------------------------------------------------------------------
+
+HOUGH_CANNY_THRESHOLD = 100      # higher threshold of the canny edge detector (opencv hough)
+HOUGH_VOTES_THRESHOLD = 20       # min amount of votes of a circle (opencv hough)
+
+# integer offsets of the circles already computed, indexed by radius
+circle_offsets = {}
+
+#--------------------------------------------------------------------------------
+
+
+# Preprocessed versions (blurred, thresholded, histograms, edges) of an eye image shared by
+# the pupil, iris and eyelids detectors. Every product is computed the first time it is
+# requested and then kept read-only, the eye image itself is never modified
+class PreprocessingContext(object):
+
+    # the eye image (grayscale)
+    img = None
+
+    # computed products, indexed by their name and parameters
+    products = None
+
+    def __init__(self, img):
+        self.img = img
+        self.products = {}
+
+    def get_product(self, key, compute, *args):
+        if key not in self.products:
+            product = compute(*args)
+            product.flags.writeable = False
+            self.products[key] = product
+
+        return self.products[key]
+
+    # histogram of the eye image
+    def get_histogram(self):
+        return self.get_product(("histogram",), build_histogram, self.img)
+
+    # median filter of the eye image
+    def get_median(self, blur_size=9 * KERNEL_SIZE_SCALE):
+        return self.get_product(("median", blur_size), cv2.medianBlur, self.img, blur_size)
+
+    # histogram of the median filter of the eye image
+    def get_median_histogram(self, blur_size=9 * KERNEL_SIZE_SCALE):
+        return self.get_product(("median_histogram", blur_size), build_histogram, self.get_median(blur_size))
+
+    # pupil candidates: 1 where the median filter of the image is at most the threshold
+    def get_pupil_mask(self, threshold, blur_size=9 * KERNEL_SIZE_SCALE):
+        return self.get_product(("pupil_mask", threshold, blur_size), get_pupil_mask, self.get_median(blur_size), threshold)
+
+    # white (skin and sclera) regions used to find the eyelids
+    def get_eyelids_mask(self):
+        return self.get_product(("eyelids_mask",), get_eyelids_mask, self.get_median(), self.get_median_histogram())
+
+    # iris boundary candidates (black) for the hough accumulator
+    def get_iris_edges(self, blur_size=IRIS_BLUR_SIZE):
+        return self.get_product(("iris_edges", blur_size), get_iris_edges, self.get_median(blur_size))
+
+
+# returns the given context, or a new one of img if there is none
+def get_context(img, context=None):
+    return PreprocessingContext(img) if context is None else context
+
+
+def get_pupil_mask(median, threshold):
+    #applying binary threshold (the pupil is black, so it is inverted to be the foreground)
+    _, mask = cv2.threshold(median, threshold, 1, cv2.THRESH_BINARY_INV)
+
+    return mask
+
+
+def get_eyelids_mask(median, median_hist):
+    #performing threshold with the "no black" index
+    no_black_threshold = get_histogram_threshold_without_black(median_hist)
+    _, eyelids = cv2.threshold(src=median, thresh=no_black_threshold, maxval=WHITE, type=cv2.THRESH_BINARY)
+
+    #performing median blur again
+    return cv2.medianBlur(src=eyelids, ksize=9 * KERNEL_SIZE_SCALE)
+
+
+# Returns a white image whose black pixels are the edges of the (median filtered) eye image
+# where the gradient is more horizontal than vertical. Those are the sides of the iris, the
+# upper and lower parts are usually covered by the eyelids and the eyelashes, whose edges are
+# mostly horizontal and would outvote the iris boundary
+def get_iris_edges(median):
+    edges = cv2.Canny(median, IRIS_CANNY_LOW_THRESHOLD, IRIS_CANNY_HIGH_THRESHOLD)
+
+    dx = cv2.Sobel(median, cv2.CV_16S, 1, 0)
+    dy = cv2.Sobel(median, cv2.CV_16S, 0, 1)
+    edges[np.abs(dx) <= np.abs(dy)] = 0
+
+    return cv2.bitwise_not(edges)
+
 #--------------------------------------------------------------------------------
 
 
-def segment_iris(eye_img):
+def segment_iris(eye_img, hough_backend=HOUGH_ACCUMULATOR):
     #image must be in grayscale
     if eye_img.dtype != np.uint8:
         return WRONG_IMAGE_FORMAT, None
 
+    #the preprocessed images are shared by the detectors
+    context = PreprocessingContext(eye_img)
+
     # ----------------------------------------------------------------------------
 
     #trying to detect pupil (from original image)
-    pupil_data = find_pupil(eye_img)
+    pupil_data = find_pupil(eye_img, context=context)
     if pupil_data is None:
         return PUPIL_DETECTION_FAILED, None
 
     # ----------------------------------------------------------------------------
 
     #detecting iris
-    iris_data = find_iris(eye_img, pupil_data[0])  # pupil_data[0] = pupil center
+    iris_data = find_iris(eye_img, pupil_data[0], hough_backend, context)  # pupil_data[0] = pupil center
     if iris_data is None:
         return IRIS_DETECTION_FAILED, (pupil_data, None, None)
 
     # ----------------------------------------------------------------------------
 
     #detecting eyelids
-    eyelids_data = find_eyelids(eye_img, pupil_data[0])
+    eyelids_data = find_eyelids(eye_img, pupil_data[0], context)
     if eyelids_data is None:
         return EYELIDS_DETECTION_FAILED, (pupil_data, iris_data, None)
 
@@ -82,88 +185,45 @@ def segment_iris(eye_img):
 
 
 #return the center and the radius
-def find_pupil(img):
-    #creating a copy of the original image
-    copy = img.copy()
-
-    #applying median filter
-    cv2.medianBlur(copy, 9 * KERNEL_SIZE_SCALE, copy)
+def find_pupil(img, context=None):
+    context = get_context(img, context)
 
     #computing pupil threshold
-    PUPIL_THRESHOLD = get_pupil_threshold(img)
-
-    #applying binary threshold
-    cv2.threshold(copy, PUPIL_THRESHOLD, WHITE, cv2.THRESH_BINARY, copy)
-
-    #ToDo: Python code here. Optimize it with cython or anything like that.
-    sumx = 0
-    sumy = 0
-    amount = 0
-
-    height, width = copy.shape
-    for x in range(width):
-        for y in range(height):
-            #black pixel
-            if not copy.item(y, x):
-                sumx += x
-                sumy += y
-                amount += 1
-
-    # If sumx and sumy are 0, that means that the filter destroyed the pupil, so
-    # autodetection failed
-    if sumx == 0 or sumy == 0:
-        return None
+    PUPIL_THRESHOLD = get_pupil_threshold(img, context)
 
-    sumx //= amount
-    sumy //= amount
+    #median filter of the image with the binary threshold applied
+    pupil_mask = context.get_pupil_mask(PUPIL_THRESHOLD)
 
-    radius = 0
-    i = sumy
-    j = sumx
-    # starting from the center and going right
-    while not copy.item(i, j):
-        radius += 1
-        j += 1
+    #labeling the black blobs, the pupil is the biggest one
+    count, _, stats, centroids = cv2.connectedComponentsWithStats(pupil_mask, connectivity=8)
 
-    # 2 of padding
-    radius -= 2
-
-    #ToDo: Read below.
-    # Here i'm going to draw a circle instead of applying sobel again. Instead of
-    # detecting the circle in the image i think i should resize the image to a
-    # smaller size so the process of finding a circle is less computationally
-    # expensive
-
-    white_img = np.ones(copy.shape, np.uint8) * 255
-    cv2.circle(white_img, (sumx, sumy), radius, BLACK, PUPIL_CIRCLE_THICKNESS)
-
-    #ToDo: Optimize here using Circle Hough Transform from OpenCV and not this function
-    center_rect = (sumx - 1, sumx + 1, sumy - 1, sumy + 1)
-    pupil_data = find_circle(white_img, center_rect, radius, radius + 4)
-
-    #if find_circle had some troubles
-    if pupil_data is None:
+    # If there are no black pixels, that means that the filter destroyed the pupil, so
+    # autodetection failed
+    if count < 2:
         return None
 
-    p1, p2, p3 = pupil_data
-    x1, y1 = p1
-    x2, y2 = p2
-    x3, y3 = p3
+    pupil_label = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])    # label 0 is the background
 
-    xc, yc = compute_circle_center_coords(x1, y1, x2, y2, x3, y3)
-    pupil_radius = euclidean_distance_coords(xc, yc, x1, y1)  # could have been p2 or p3
+    #the center is the centroid of the blob and the radius the one of a circle with its area
+    xc, yc = centroids[pupil_label]
+    pupil_radius = sqrt(stats[pupil_label, cv2.CC_STAT_AREA] / pi)
 
-    return (xc, yc), int(pupil_radius + PUPIL_RADIUS_INC)
+    return (int(round(xc)), int(round(yc))), int(pupil_radius + PUPIL_RADIUS_INC)
 
 
-#the img is the binary thing, not the original
-def find_iris(img, pupil_center):
+#the img is the eye image (the accumulator finds the circle in its iris edges, see get_iris_edges)
+def find_iris(img, pupil_center, hough_backend=HOUGH_ACCUMULATOR, context=None):
     xc, yc = pupil_center
     center_rect = (xc - PUPIL_CENTER_OFFSET, xc + PUPIL_CENTER_OFFSET,
                    yc - PUPIL_CENTER_OFFSET, yc + PUPIL_CENTER_OFFSET)
     height, width = img.shape
 
-    iris_data = find_circle(img, center_rect, width // 4, height // 2)
+    #the accumulator only votes the black pixels, so it needs the iris edges (opencv finds the
+    #edges by itself)
+    if hough_backend == HOUGH_ACCUMULATOR:
+        img = get_context(img, context).get_iris_edges()
+
+    iris_data = find_circle(img, center_rect, width // 4, height // 2, hough_backend)
 
     #if find_circle had some troubles
     if iris_data is None:
@@ -181,19 +241,9 @@ def find_iris(img, pupil_center):
 
 
 #This is practically the same implementation of project iris
-def find_eyelids(img, pupil_center):
-    #performing the "otsu" thresholding
-    eyelids = img.copy()
-
-    #performing median blur
-    cv2.medianBlur(src=eyelids, ksize=9 * KERNEL_SIZE_SCALE, dst=eyelids)
-
-    #performing threshold with the "no black" index
-    no_black_threshold = get_threshold_without_black(eyelids)
-    cv2.threshold(src=eyelids, thresh=no_black_threshold, maxval=WHITE, type=cv2.THRESH_BINARY, dst=eyelids)
-
-    #performing median blur again
-    eyelids = cv2.medianBlur(src=eyelids, ksize=9 * KERNEL_SIZE_SCALE, dst=eyelids)
+def find_eyelids(img, pupil_center, context=None):
+    #performing the "otsu" thresholding of the median filter of the image (and blurring it again)
+    eyelids = get_context(img, context).get_eyelids_mask()
 
     #finding eyelids
     xc, _ = pupil_center               # pupil_center is a tuple with 2 elements
@@ -202,36 +252,35 @@ def find_eyelids(img, pupil_center):
     point_dist = EYELIDS_POINTS_DISTANCE
     padding = EYELIDS_PADDING
 
-    upper_eyelid = [None, None, None]
-    lower_eyelid = [None, None, None]
+    #columns of the eyelid points (the upper eyelid is sampled 50 pixels to the right)
+    columns = width - point_dist + np.arange(EYELID_POINTS_COUNT) * point_dist
+
+    # First eyelid (top-down): rows 0, 1, ..., height - 1
+    upper_rows = eyelids[:height, columns + 50] != WHITE
 
-    #ToDo: Python code here. Optimize it with cython or anything like that.
-    for i in range(height):
+    # second eyelid (bottom-up): rows 2 * height, 2 * height - 1, ..., height + 1
+    lower_rows = eyelids[2 * height - np.arange(height)][:, columns] != WHITE
 
-        # First eyelid (top-down)
-        for j in range(EYELID_POINTS_COUNT):
-            dist_along = width - point_dist + (j * point_dist)
-            if not upper_eyelid[j] and eyelids.item(i, dist_along + 50) != WHITE:
-                upper_eyelid[j] = (dist_along, i + padding)
+    #cheking if eyelids were found (every column must have a non white pixel)
+    if not upper_rows.any(axis=0).all() or not lower_rows.any(axis=0).all():
+        return None
 
-        # second eyelid (bottom-up)
-        for j in range(EYELID_POINTS_COUNT):
-            dist_along = width - point_dist + (j * point_dist)
-            if not lower_eyelid[j] and eyelids.item(2 * height - i, dist_along) != WHITE:
-                lower_eyelid[j] = (dist_along, 2 * height - i)
+    #the first non white pixel of every column (argmax returns the first True)
+    upper_i = upper_rows.argmax(axis=0)
+    lower_i = lower_rows.argmax(axis=0)
 
-    #cheking if eyelids were found
-    for i in range(EYELID_POINTS_COUNT):
-        if not upper_eyelid[i] or not lower_eyelid[i]:
-            return None
+    upper_eyelid = tuple((int(columns[j]), int(upper_i[j]) + padding) for j in range(EYELID_POINTS_COUNT))
+    lower_eyelid = tuple((int(columns[j]), 2 * height - int(lower_i[j])) for j in range(EYELID_POINTS_COUNT))
 
     #assuming it always went well
-    return tuple(upper_eyelid), tuple(lower_eyelid)
+    return upper_eyelid, lower_eyelid
 
 
-#ToDo: This is a Circle Hough Transform implementation. Use the one in OpenCV
-#ToDo: Python code here. Optimize it with cython or anything like that.
-def find_circle(img, centerRegion, minRadius, maxRadius):
+# Circle Hough Transform. Finds the circle (with center inside centerRegion and radius in
+# [minRadius, maxRadius)) that most black pixels of the image belong to, and returns three of
+# its points. The accumulator implementation averages every circle with at least the max
+# amount of votes - 1, the opencv one takes the best circle found by cv2.HoughCircles
+def find_circle(img, centerRegion, minRadius, maxRadius, backend=HOUGH_ACCUMULATOR):
     #centerRegion is the rectangle for iris center
 
     if centerRegion is None:
@@ -239,6 +288,30 @@ def find_circle(img, centerRegion, minRadius, maxRadius):
         # (x_left, x_right, y_top, y_bottom) ->the whole image
         centerRegion = (0, width - 1, 0, height - 1)
 
+    if backend == HOUGH_OPENCV:
+        circle = find_circle_opencv(img, centerRegion, minRadius, maxRadius)
+    else:
+        circle = find_circle_accumulator(img, centerRegion, minRadius, maxRadius)
+
+    #if no circle was found
+    if circle is None:
+        return None
+
+    top_a, top_b, top_r = circle
+
+    # Returning the three points
+    p1 = (top_a + top_r, top_b)
+    p2 = (top_a - top_r, top_b)
+    p3 = (top_a, top_b + top_r)
+
+    return p1, p2, p3
+
+
+# Votes every black pixel into the (a, b, r) accumulator at once: for each radius, the pixel
+# votes for the centers at the integer offsets of the circle of that radius. Returns the
+# average center and radius of the cells with at least the max amount of votes - 1, or None
+# if no cell got a vote
+def find_circle_accumulator(img, centerRegion, minRadius, maxRadius):
     x_left, x_right, y_top, y_bottom = centerRegion
     a_min = x_left
     a_max = x_right
@@ -252,166 +325,153 @@ def find_circle(img, centerRegion, minRadius, maxRadius):
     b = b_max - b_min
     r = r_max - r_min
 
-    # The sum of the values which are >= maxVotes - 1
-    total_r = 0
-    total_a = 0
-    total_b = 0
+    # Create and initialise accumulator to 0
+    acc = np.zeros((r, a, b), np.int32)
+
+    # coordinates of the black points (the only ones that vote)
+    y, x = np.nonzero(img == BLACK)
+
+    # For each black point, find the circles which satisfy the equation where the
+    # parameters are limited by a,b and r.
+    for _r in range(r):
+        dx, dy = get_circle_offsets(_r + r_min)
+
+        # centers (relative to the region) of the circles of this radius through every point
+        _a = (x.reshape((-1, 1)) - dx - a_min).ravel()
+        _b = (y.reshape((-1, 1)) - dy - b_min).ravel()
 
-    # Amount of values that are >= maxVotes - 1
-    amount = 0
+        inside = (0 <= _a) & (_a < a) & (0 <= _b) & (_b < b)
+        acc[_r] = np.bincount(_a[inside] * b + _b[inside], minlength=a * b).reshape((a, b))
 
     # The max amount of votes that any has
-    maxVotes = 0
+    maxVotes = acc.max() if acc.size else 0
 
-    # Create and initialise accumulator to 0
-    acc = np.zeros((a, b, r), np.int32)
+    # if no black point voted there is no circle (every cell would pass the test below, and
+    # the average would be the middle of the parameters space)
+    if maxVotes == 0:
+        return None
 
-    # For each black point, find the circles which satisfy the equation where the
-    # parameters are limited by a,b and r.
-    height, width = img.shape
-    for x in range(width):
-        for y in range(height):
-            #if pixel is white continue
-            if img.item(y, x):
-                continue
-
-            for _a in range(a):
-                for _b in range(b):
-                    for _r in range(r):
-                        sq_a = x - (_a + a_min)
-                        sq_b = y - (_b + b_min)
-                        sq_r = r - (_r + r_min)
-
-                        if sq_a * sq_a + sq_b * sq_b == sq_r * sq_r:
-                            new_value = acc.item((_a, _b, _r)) + 1
-                            acc.itemset((_a, _b, _r), new_value)
-
-                            if new_value >= maxVotes:
-                                maxVotes = new_value
-
-    for _a in range(a):
-        for _b in range(b):
-            for _r in range(r):
-                if acc.item((_a, _b, _r)) >= maxVotes - 1:
-                    total_a += _a + a_min
-                    total_b += _b + b_min
-                    total_r += _r + r_min
-                    amount += 1
+    # The values which are >= maxVotes - 1
+    _r, _a, _b = np.nonzero(acc >= maxVotes - 1)
 
     # Get the initial average values
-    top_a = total_a / amount
-    top_b = total_b / amount
-    top_r = total_r / amount
+    top_a = _a.mean() + a_min
+    top_b = _b.mean() + b_min
+    top_r = _r.mean() + r_min
 
-    # Returning the three points
-    p1 = (top_a + top_r, top_b)
-    p2 = (top_a - top_r, top_b)
-    p3 = (top_a, top_b + top_r)
+    return top_a, top_b, top_r
 
-    return p1, p2, p3
 
+# Returns the integer offsets (dx, dy) of the points of the circle with the given radius,
+# those with dx * dx + dy * dy == radius * radius. They are computed once per radius
+def get_circle_offsets(radius):
+    if radius in circle_offsets:
+        return circle_offsets[radius]
 
-#ToDo: Python code here. Optimize it with cython or anything like that.
-def get_pupil_threshold(img):
-    hist = build_histogram(img)
-    pupil_max = -1
-    pupil_max_index = -1
+    # for every dx, dy is a solution if radius^2 - dx^2 is a perfect square
+    dx = np.arange(-radius, radius + 1)
+    dy_2 = radius * radius - dx * dx
+    dy = np.round(np.sqrt(dy_2)).astype(dx.dtype)
+    on_circle = dy * dy == dy_2
 
-    for i in range(90):
-        current_value = hist.item(i)
+    dx = dx[on_circle]
+    dy = dy[on_circle]
 
-        if current_value > pupil_max:
-            pupil_max = current_value
-            pupil_max_index = i
+    # every point has its symmetric one (y => -y), but those at dy = 0 are the same point
+    offsets = (np.concatenate((dx, dx[dy != 0])), np.concatenate((dy, -dy[dy != 0])))
 
-    return pupil_max_index + 8
+    for arr in offsets:
+        arr.flags.writeable = False
 
+    circle_offsets[radius] = offsets
 
-#ToDo: Python code here. Optimize it with cython or anything like that.
-def get_iris_threshold(img):
-    first_max_index = -1
-    second_max_index = -1
-    min_index = -1
+    return offsets
 
+
+# Finds the circles with cv2.HoughCircles (gradient method) and returns the best one whose
+# center is inside the region
+def find_circle_opencv(img, centerRegion, minRadius, maxRadius):
+    x_left, x_right, y_top, y_bottom = centerRegion
+
+    circles = cv2.HoughCircles(img, cv2.HOUGH_GRADIENT, dp=1, minDist=1, param1=HOUGH_CANNY_THRESHOLD,
+                               param2=HOUGH_VOTES_THRESHOLD, minRadius=minRadius, maxRadius=maxRadius - 1)
+
+    if circles is None:
+        return None
+
+    # the circles are sorted by their votes
+    for top_a, top_b, top_r in circles[0]:
+        if x_left <= top_a < x_right and y_top <= top_b < y_bottom:
+            return float(top_a), float(top_b), float(top_r)
+
+    return None
+
+
+# the pupil threshold is the darkest peak of the histogram (the first max in [0, 90)) plus 8
+def get_pupil_threshold(img, context=None):
+    hist = get_context(img, context).get_histogram()
+    pupil_max_index = int(np.argmax(hist[:90]))
+
+    return pupil_max_index + 8
+
+
+def get_iris_threshold(img, context=None):
     #The histogram generally shows 4 peaks as a property of the image. The darkest peak
     #represents the mass of dark pixels in the pupil, the next lightest peak is usually
     #the overall mass of pixels in the iris. It is usually a good idea to apply the median
     #filter first to the image to extract the best peaks out of the image to avoid
-    #variation from noise.
-    cv2.medianBlur(img, 9 * KERNEL_SIZE_SCALE, img)
+    #variation from noise (the image itself is not modified).
+    median_hist = get_context(img, context).get_median_histogram()
 
     #building a smoooth histogram
-    smooth_hist = build_smooth_histogram(img)
+    smooth_hist = smooth_histogram(median_hist)
 
     #Plotted on a graph, we should have some distinct peaks, two for the greyish centres. The
     #first, and highest peak is what we want to threshold around so we drop the 8 outermost
-    #groups and find the maximum value.
-    first_max = -1
-    for i in range(90, 240):
-        current_value = smooth_hist.item(i)
-
-        if current_value > first_max:
-            first_max = current_value
-            first_max_index = i
+    #groups and find the maximum value (argmax returns the first one).
+    first_max_index = 90 + int(np.argmax(smooth_hist[90:240]))
+    first_max = smooth_hist[first_max_index]
 
     #Now find the second maximum so that we can threshold around this central point.
-    #Possibly more accurate.
-    second_max = -1
-
-    #first search to the right
-    for i in range(first_max_index + 20, 240):
-        current_value = smooth_hist.item(i)
-
-        if current_value > second_max:
-            second_max = current_value
-            second_max_index = i
-
-    #now search to the left (change)
-    for i in range(91, (first_max_index - 20) + 1):
-        current_value = smooth_hist.item(i)
-
-        if current_value > second_max:
-            second_max = current_value
-            second_max_index = i
-
-    #Now find the minimum between these two.
-    minimum = first_max
+    #Possibly more accurate. First search to the right and then to the left, so a value to
+    #the left must be strictly greater to be taken.
+    candidates = np.concatenate((np.arange(first_max_index + 20, 240), np.arange(91, (first_max_index - 20) + 1)))
+    second_max_index = int(candidates[np.argmax(smooth_hist[candidates])]) if candidates.size else -1
 
     #swap them if necessary
-    #ToDo: Fix. Non-pythonic code.
-    if first_max_index > second_max_index:
-        tmp = first_max_index
-        first_max_index = second_max_index
-        second_max_index = tmp
-
-    for i in range(first_max_index, second_max_index):
-        current_value = smooth_hist.item(i)
+    first_max_index, second_max_index = min(first_max_index, second_max_index), max(first_max_index, second_max_index)
 
-        if current_value < minimum:
-            minimum = current_value
-            min_index = i
+    #Now find the minimum between these two (it must be lower than the first maximum).
+    #As in the original loop, a negative index is taken from the end of the histogram
+    between = np.arange(first_max_index, second_max_index)
+    min_index = -1
+    if between.size:
+        lowest = int(np.argmin(smooth_hist[between]))
+        if smooth_hist[between[lowest]] < first_max:
+            min_index = int(between[lowest])
 
-    return  first_max_index, second_max_index, min_index
+    return first_max_index, second_max_index, min_index
 
 
 def build_histogram(img):
     return cv2.calcHist([img], [0], None, [256], [0, 256])
 
 
-#ToDo: Python code here. Optimize it by using cython or anything like that.
 def build_smooth_histogram(img):
-    hist = build_histogram(img)
-    smooth_hist = np.array([0] * 256, np.int32)
+    return smooth_histogram(build_histogram(img))
 
-    smooth_hist.itemset(0, (hist.item(0) + hist.item(1)) / 2)
 
-    for i in range(1, 255):
-        value = (hist.item(i - 1) + hist.item(i) + hist.item(i + 1)) / 3
-        smooth_hist.itemset(i, value)
+# every bin is the mean of the bins around it (truncated), the first and the last ones only
+# have one neighbour
+def smooth_histogram(hist):
+    hist = hist.ravel().astype(np.float64)
+    smooth_hist = np.empty(256, np.float64)
 
-    smooth_hist.itemset(255, (hist.item(254) + hist.item(255)) / 2)
+    smooth_hist[0] = (hist[0] + hist[1]) / 2
+    smooth_hist[1:255] = (hist[:254] + hist[1:255] + hist[2:]) / 3
+    smooth_hist[255] = (hist[254] + hist[255]) / 2
 
-    return smooth_hist
+    return smooth_hist.astype(np.int32)
 
 
 #we assume that src has the same size of other, and both are of dtype = uint8
@@ -428,36 +488,25 @@ def min_blend(src, other):
     return result
 
 
+#we assume that src has the same size of other, and both are of dtype = uint8
 def add_blend(src, other):
-    #ToDo: I'm going to do it by hand for now. Find how to do it with OpenCV
-    height, width = src.shape
+    #saturated sum (cv2.add clips it to 255), inverted
     result = np.empty(src.shape, np.uint8)
-
-    for i in range(height):
-        for j in range(width):
-            pix_value = src.item(i, j) + other.item(i, j)
-
-            if pix_value > 255:
-                pix_value = 255
-
-            #ToDo: I think it could be removed, because the sum will always be > 0
-            elif pix_value < 0:
-                pix_value = 0
-
-            result.itemset(i, j, 255 - pix_value)
-
+    cv2.add(src, other, result)
+    cv2.bitwise_not(result, result)
     return result
 
 
-#ToDo: Python code here. Optimize it by using cython or anything like that.
+# otsu threshold of the pixels that are not black (those with value >= BLACK_THRESHOLD)
 def get_threshold_without_black(img):
-    #computing histogram
-    hist = build_histogram(img)
+    return get_histogram_threshold_without_black(build_histogram(img))
+
+
+def get_histogram_threshold_without_black(hist):
+    hist = hist.ravel().astype(np.float64)
 
     #computing number of pixels with value >= 80
-    pixel_count = 0
-    for i in range(BLACK_THRESHOLD, 256):
-        pixel_count += hist.item(i)
+    pixel_count = hist[BLACK_THRESHOLD:].sum()
 
     #computing the probability distribution from histogram
     p = compute_probability_distribution(hist, pixel_count)
@@ -466,64 +515,52 @@ def get_threshold_without_black(img):
     return get_max_goodness_index(p)
 
 
-#ToDo: Python code here. Optimize it by using cython or anything like that.
-#ToDo: Do all in a single pass-omega, mew, etc- (i want this code to resemble the project iris source code)
+# The goodness of every threshold k is (mew(256) * omega(k) - mew(k))^2 / (omega(k) * (1 - omega(k))),
+# where omega and mew are prefix sums of the probability distribution. Returns the first k
+# with the max goodness
 def get_max_goodness_index(prob_dist):
-    #compute goodness array
-    goodness = np.empty(256, np.float32)
-    mew_256 = compute_mew(256, prob_dist)
-    for k in range(256):
-        wk = compute_omega(k, prob_dist)
-        mk = compute_mew(k, prob_dist)
-
-        if wk == 0 or wk == 1:
-            goodness_value = 0
-        else:
-            factor = mew_256 * wk - mk
-            num = factor * factor
-            den = wk * (1.0 - wk)
-            goodness_value = num / den
+    omega = compute_omega(prob_dist)
+    mew = compute_mew(prob_dist)
+    mew_256 = mew[256]
 
-        goodness.itemset(k, goodness_value)
+    #compute goodness array (0 where the threshold leaves every pixel on one side)
+    wk = omega[:256]
+    mk = mew[:256]
+    defined = (wk != 0) & (wk != 1)
 
-    #get max index (this can be done in the previous step)
-    max_index = 0
-    for i in range(256):
-        if goodness.item(i) > goodness.item(max_index):
-            max_index = i
+    factor = mew_256 * wk - mk
+    num = factor * factor
+    den = np.where(defined, wk * (1.0 - wk), 1.0)
+    goodness = np.where(defined, num / den, 0.0).astype(np.float32)
 
-    return max_index
+    #get max index (argmax returns the first one)
+    return int(np.argmax(goodness))
 
 
-#ToDo: Python code here. Optimize it by using cython or anything like that.
 def compute_probability_distribution(hist, total_pixels):
-    prob_dist = np.empty(256, dtype=np.float32)
     total = float(total_pixels)
 
-    for i in range(256):
-        if i < BLACK_THRESHOLD:
-            prob_dist.itemset(i, 0.0)
-        else:
-            prob_dist.itemset(i, hist.item(i) / total)
-
-    return prob_dist
+    #an image without non black pixels has no distribution (as the loop version, which divided item by item)
+    if total == 0:
+        raise ZeroDivisionError("there are no pixels with value >= %d" % BLACK_THRESHOLD)
 
+    prob_dist = (np.asarray(hist, np.float64).ravel() / total).astype(np.float32)
+    prob_dist[:BLACK_THRESHOLD] = 0.0
 
-#ToDo: Python code here. Optimize it by using cython or anything like that.
-def compute_omega(k, prob_dist):
-    result = 0.0
+    return prob_dist
 
-    for i in range(k):
-        result += prob_dist.item(i)
 
-    return result
+# returns omega(k), the sum of the probabilities of the values lower than k, for 0 <= k <= 256
+def compute_omega(prob_dist):
+    omega = np.zeros(257, np.float64)
+    np.cumsum(prob_dist.astype(np.float64), out=omega[1:])
 
+    return omega
 
-#ToDo: Python code here. Optimize it by using cython or anything like that.
-def compute_mew(k, prob_dist):
-    result = 0.0
 
-    for i in range(k):
-        result += (i + 1) * prob_dist.item(i)
+# returns mew(k), the sum of (i + 1) * p(i) for the values i lower than k, for 0 <= k <= 256
+def compute_mew(prob_dist):
+    mew = np.zeros(257, np.float64)
+    np.cumsum(np.arange(1, 257) * prob_dist.astype(np.float64), out=mew[1:])
 
-    return result
+    return mew
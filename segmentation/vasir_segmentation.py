@@ -1,6 +1,6 @@
 import cv2
 import numpy as np
-from math import sqrt, atan2, pi, pow, ceil, floor, cos, sin
+from math import sqrt, pi, ceil, floor, cos, sin
 
 from segmentation.projectiris_segmentation import find_eyelids
 
@@ -388,8 +388,6 @@ def find_circle(image, l_radius, u_radius, scaling, sigma, hi_thres, low_thres,
     return row, col, r
 
 
-#ToDo: Python code here. Optimize it with cython or anything like that.
-#ToDo: The function can be optimized in less loops, but we might lose clarity
 def canny(im, sigma, scaling, vert, horz):
     x_scaling = vert
     y_scaling = horz
@@ -406,83 +404,25 @@ def canny(im, sigma, scaling, vert, horz):
     new_width = int(im_width * scaling)
     new_im = cv2.resize(new_im, (new_width, new_height))
 
-    rows, cols = new_im.shape
-    new_im = new_im.reshape(new_width * new_height)
+    # padding the image with zeros, so the pixels outside of it count as 0 in the differences
+    # (they are computed in float64, in uint8 they would wrap around)
+    padded = np.pad(new_im.astype(np.float64), 1)
 
-    h = np.empty(rows * cols, np.float64)
-    v = np.empty(rows * cols, np.float64)
-    for i in range(rows):
-        for j in range(cols):
-            l_index = i * cols + j
-
-            if j == 0:
-                h[l_index] = new_im[i * cols + 1]
-            elif j == cols - 1:
-                h[l_index] = -new_im[i * cols + j - 1]
-            else:
-                h[l_index] = new_im[i * cols + j + 1] - new_im[i * cols + j - 1]
-
-            # ---------------------------------
-
-            if i == 0:
-                v[l_index] = new_im[(i + 1) * cols + j]
-            elif i == rows - 1:
-                v[l_index] = -new_im[(i - 1) * cols + j]
-            else:
-                v[l_index] = new_im[(i + 1) * cols + j] - new_im[(i - 1) * cols + j]
-
-    d1 = np.empty(rows * cols, np.float64)
-    d2 = np.empty(rows * cols, np.float64)
-    for i in range(rows):
-        for j in range(cols):
-            l_index = i * cols + j
-
-            if i == rows - 1 or j == cols - 1:
-                begin = 0
-            else:
-                begin = new_im[(i + 1) * cols + j + 1]
-
-            if i == 0 or j == 0:
-                end = 0
-            else:
-                end = new_im[(i - 1) * cols + j - 1]
-
-            d1[l_index] = begin - end
-
-            # ---------------------------------
-
-            if i == 0 or j == cols - 1:
-                begin = 0
-            else:
-                begin = new_im[(i - 1) * cols + j + 1]
-
-            if i == rows - 1 or j == 0:
-                end = 0
-            else:
-                end = new_im[(i + 1) * cols + j - 1]
-
-            d2[l_index] = begin - end
-
-    gradient = np.empty((rows, cols), np.float64)
-    or_nd = np.empty((rows, cols), np.float64)
+    # horizontal, vertical and diagonal differences (of the neighbours of every pixel)
+    h = padded[1:-1, 2:] - padded[1:-1, :-2]
+    v = padded[2:, 1:-1] - padded[:-2, 1:-1]
+    d1 = padded[2:, 2:] - padded[:-2, :-2]
+    d2 = padded[:-2, 2:] - padded[2:, :-2]
 
-    for i in range(rows * cols):
-        r = i // cols
-        c = i % cols
+    X = (h + (d1 + d2) / 2.0) * x_scaling
+    Y = (v + (d1 + d2) / 2.0) * y_scaling
 
-        d1i = d1[i]
-        d2i = d2[i]
+    gradient = np.sqrt(X * X + Y * Y)
 
-        X = (h[i] + (d1i + d2i) / 2.0) * x_scaling
-        Y = (v[i] + (d1i + d2i) / 2.0) * y_scaling
-
-        gradient[r, c] = sqrt(X * X + Y * Y)
-
-        or_nd_value = atan2(-Y, X)
-        if or_nd_value < 0:
-            or_nd_value += pi
-
-        or_nd[r, c] = or_nd_value / pi * 180
+    # orientation in [0, 180] degrees
+    or_nd = np.arctan2(-Y, X)
+    or_nd[or_nd < 0] += pi
+    or_nd = or_nd / pi * 180
 
     return gradient, or_nd
 
@@ -499,12 +439,10 @@ def adjust_gamma(im, g):
     im_adjusted -= min_val
 
     max_val = im_adjusted.max()
-    rows, cols = im_adjusted.shape
-    for i in range(rows):
-        for j in range(cols):
-            im_adjusted[i, j] = pow(im_adjusted[i, j] / max_val, 1.0 / g)
 
-    return im_adjusted
+    # the gradient is not quantized, so the gamma curve is evaluated on every pixel (there is
+    # no lookup table to build)
+    return np.power(im_adjusted / max_val, 1.0 / g)
 
 
 def non_max_suppression(in_image, orient, radius):
@@ -532,144 +470,62 @@ def non_max_suppression(in_image, orient, radius):
     yoff[180] = 0
     xoff[90] = 0
 
-    # now run through the image interpolating grey values on each side of the centre pixel to be used for the
-    # non-maximal suppression.
-    for row in range(i_radius, rows - i_radius):
-        for col in range(i_radius, rows - i_radius):
-            ori = int(orient[row, col] + ADJ_PRECISION)     # index into precomputed arrays
+    # the pixels far enough from the borders (so the interpolated ones are inside the image)
+    if rows <= 2 * i_radius or cols <= 2 * i_radius:
+        return im
 
-            # x, y location on one side of the point in question
-            x = col + xoff[ori]
-            y = row - yoff[ori]
+    row, col = np.mgrid[i_radius:rows - i_radius, i_radius:cols - i_radius]
+    in_image_value = in_image[i_radius:rows - i_radius, i_radius:cols - i_radius]
 
-            # get integer pixel locations that surround location x,y
-            fx = int(floor(x))
-            cx = int(ceil(x))
-            fy = int(floor(y))
-            cy = int(ceil(y))
+    ori = (orient[i_radius:rows - i_radius, i_radius:cols - i_radius] + ADJ_PRECISION).astype(np.int64)     # index into precomputed arrays
 
-            tl = in_image[fy, fx]   # value at top left integer pixel location.
-            tr = in_image[fy, cx]   # top right
-            bl = in_image[cy, fx]   # bottom left
-            br = in_image[cy, cx]   # bottom right
+    # now interpolate the grey values on each side of every pixel (at the x, y location on one
+    # side, and on the 'other side' of the point in question)
+    v1 = interpolate_pixels(in_image, col + xoff[ori], row - yoff[ori], hfrac[ori], vfrac[ori])
+    v2 = interpolate_pixels(in_image, col - xoff[ori], row + yoff[ori], hfrac[ori], vfrac[ori])
 
-            upperavg = tl + hfrac[ori] * (tr - tl)  # now use bilinear interpolation to
-            loweravg = bl + hfrac[ori] * (br - bl)  # estimate value at x,y
-            v1 = upperavg + vfrac[ori] * (loweravg - upperavg)
+    # the local maxima are recorded in the output image
+    maxima = (in_image_value > v1) & (in_image_value > v2)
+    im[i_radius:rows - i_radius, i_radius:cols - i_radius][maxima] = in_image_value[maxima]
 
-            in_image_value = in_image[row, col]
+    return im
 
-            if in_image_value > v1:     # we need to check the value on the other side...
 
-                x = col - xoff[ori]    # x, y location on the 'other side' of the point in question
-                y = row + yoff[ori]
+# bilinear interpolation of the image at the arrays x, y, with the given fractional offsets
+def interpolate_pixels(in_image, x, y, hfrac, vfrac):
+    # get integer pixel locations that surround locations x,y
+    fx = np.floor(x).astype(np.int64)
+    cx = np.ceil(x).astype(np.int64)
+    fy = np.floor(y).astype(np.int64)
+    cy = np.ceil(y).astype(np.int64)
 
-                fx = int(floor(x))
-                cx = int(ceil(x))
-                fy = int(floor(y))
-                cy = int(ceil(y))
+    tl = in_image[fy, fx]   # value at top left integer pixel location.
+    tr = in_image[fy, cx]   # top right
+    bl = in_image[cy, fx]   # bottom left
+    br = in_image[cy, cx]   # bottom right
 
-                tl = in_image[fy, fx]    # value at top left integer pixel location.
-                tr = in_image[fy, cx]    # top right
-                bl = in_image[cy, fx]    # bottom left
-                br = in_image[cy, cx]    # bottom right
+    upperavg = tl + hfrac * (tr - tl)  # now use bilinear interpolation to
+    loweravg = bl + hfrac * (br - bl)  # estimate value at x,y
 
-                upperavg = tl + hfrac[ori] * (tr - tl)
-                loweravg = bl + hfrac[ori] * (br - bl)
-                v2 = upperavg + vfrac[ori] * (loweravg - upperavg)
+    return upperavg + vfrac * (loweravg - upperavg)
 
-                if in_image_value > v2:          # this is a local maximum.
-                    im[row, col] = in_image_value # record value in the output image.
 
-    return im
+# Hysteresis thresholding: the edges are the pixels > t1 and those > t2 connected to them
+# (8-connectivity), that is the connected components of the pixels > t2 (or > t1) holding a
+# pixel > t1
+def hys_thresh(im, t1, t2):
+    strong = im > t1
+    weak = (im > t2) | strong
 
+    _, labels = cv2.connectedComponents(weak.astype(np.uint8), connectivity=8)
 
-def hys_thresh(im, t1, t2):
-    # getting image dimensions
-    rows, cols = im.shape
-    n_data = rows * cols
-
-    rc = n_data
-    rcmr = rc - cols - 1
-    rp1 = cols
-
-    # creating the thresholded image
-    im_thresholded = np.empty((rows, cols), np.uint8)
-
-    # find indices of all pixels with value > T1 and the amount
-    bw = im.reshape(n_data)
-    pix = np.empty(n_data, np.float64)
-    npix = 0
-    for i in range(n_data):
-        if bw[i] > t1:
-            pix[npix] = i
-            npix += 1
-
-    # create a stack array (that should never overflow!
-    stack = np.zeros(n_data, np.int32)
-
-    # setting stack pointer (stp)
-    stp = npix - 1
-    for i in range(npix):
-        stack[i] = pix[i]   # put all the edge points on the stack
-        bw[pix[i]] = -1     # mark points as edges
-
-    # precompute an array, O, of index offset values that correspond to the eight
-    # surrounding pixels of any point. Note that the image was transformed into
-    # a column vector, so if we reshape the image back to a square the indices
-    # surrounding a pixel with index, n, will be:
-    #       n-cols-1   n-1   n+cols-1
-    #
-    #       n-cols     n     n+cols
-    #
-    #       n-cols+1   n+1   n+cols+1
-
-    tmp = np.empty(8, np.int32)
-    index = np.empty(8, np.int32)
-
-    tmp[0] = -1
-    tmp[1] = 1
-    tmp[2] = -cols - 1
-    tmp[3] = -cols
-    tmp[4] = -cols + 1
-    tmp[5] = cols - 1
-    tmp[6] = cols
-    tmp[7] = cols + 1
-
-    # while the stack is not empty
-    while stp >= 0:
-        v = stack[stp]      # pop next index off the stack
-        stp -= 1
-
-        # prevent us from generating illegal indices
-        if rp1 < v < rcmr:
-            # now look at surrounding pixels to see if they should be pushed onto the
-            # stack to be processed as well.
-
-            # calculate indices of points around this pixel.
-            for i in range(8):
-                index[i] = tmp[i] + v
-
-            for l in range(8):
-                ind = index[l]
-
-                if bw[ind] > t2:
-                    stp += 1            # push index onto the stack.
-                    stack[stp] = ind
-                    bw[ind] = -1        # mark this as an edge point
-
-    # finally zero out anything that was not an edge
-    for i in range(n_data):
-        if bw[i] == -1:
-            bw[i] = 1
-        else:
-            bw[i] = 0
-
-    # reshaping bw
-    bw = bw.reshape(rows, cols)
-
-    # returning bw
-    return bw
+    # the components with a pixel > t1 (label 0 is the background)
+    edge_labels = np.zeros(labels.max() + 1, bool)
+    edge_labels[labels[strong]] = True
+    edge_labels[0] = False
+
+    # 1 for the edges and 0 for anything else
+    return edge_labels[labels].astype(im.dtype)
 
 
 def hough_circles(m_edge_im, r_min, r_max):
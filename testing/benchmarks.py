@@ -0,0 +1,511 @@
+import os
+import time
+
+from math import pi
+
+import cv2
+import numpy as np
+
+import segmentation.projectiris_segmentation as proj_iris_segm
+
+import normalization.projectiris_normalization as proj_iris_norm
+import normalization.rubbersheet_normalization as rubb_sheet_norm
+
+import encoding.fourier_encoding as fou_enc
+import encoding.fda_encoding as fda_enc
+import encoding.zcp_encoding as zcp_enc
+import encoding.zap_encoding as zap_enc
+
+from fda.zernike_circular_polynomial import ZernikeCircularSingle
+from fda.zernike_annular_polynomial import ZernikeAnnularSingle
+
+from recognition.iris_recognition_algorithm import RecognitionAlgorithm, generates_binary_template, generates_vector_template
+
+from utils.error_utils import SUCCESS
+from utils.image_utils import mask_image
+from utils.testing_utils import STD_RADII, STD_ANGLES, IMAGES_PATH, MASKS_PATH, UPOL, CASIA_1, MMU, UBIRIS, \
+    get_base_path, get_image_class
+from utils.recognition_definitions import *
+
+# ----------------------------------------------------------------------------------
+
+# times every benchmarked function is run
+BENCHMARK_REPEAT = 10
+
+# sample eye images shipped with the application
+SAMPLE_IMAGES_PATH = "./iris-images/"
+
+# ----------------------------------------------------------------------------------
+
+
+# returns the average running time (in ms) of func(*args)
+def time_function(func, args, repeat=BENCHMARK_REPEAT):
+    start = time.time()
+    for _ in range(repeat):
+        func(*args)
+    end = time.time() - start
+
+    return end * 1000 / repeat
+
+
+# creates a random normalized iris image and its mask
+def random_normalized_iris(radii=STD_RADII, angles=STD_ANGLES, seed=0):
+    rng = np.random.RandomState(seed)
+
+    norm_img = rng.randint(0, 256, (radii, angles)).astype(np.uint8)
+    mask_img = (rng.rand(radii, angles) > 0.1).astype(np.uint8)
+
+    return norm_img, mask_img
+
+# ----------------------------------------------------------------------------------
+
+
+# per pixel implementation of the fourier encoder, as it was before the vectorized one (its
+# imaginary bit was always set: 'else 1')
+def fourier_encode_loop(norm_img, mask_img):
+    radii, angles = norm_img.shape
+
+    bit_code = np.empty(2 * radii * angles, np.uint8)
+    bit_code_mask = np.empty(2 * radii * angles, np.uint8)
+
+    encoded_img = fou_enc.fourier_image(norm_img)
+
+    index = 0
+    for radius in range(radii):
+        for theta in range(angles):
+            bit_code[index] = 1 if encoded_img[radius, theta].real >= 0.0 else 0
+            bit_code[index + 1] = 1 if encoded_img[radius, theta].imag >= 0.0 else 1
+
+            value = 1 if mask_img[radius, theta] else 0
+            bit_code_mask[index] = value
+            bit_code_mask[index + 1] = value
+
+            index += 2
+
+    return SUCCESS, bit_code, bit_code_mask
+
+
+# compares the original per pixel fourier encoder against the vectorized one. The real bits
+# and the mask must be the same (same_result), and the imaginary bits are the intended change:
+# the fraction of them that are now cleared (they follow the sign of the imaginary part) is
+# returned as imag_changed
+def benchmark_fourier_encoding(radii=STD_RADII, angles=STD_ANGLES, repeat=BENCHMARK_REPEAT):
+    norm_img, mask_img = random_normalized_iris(radii, angles)
+
+    _, loop_code, loop_mask = fourier_encode_loop(norm_img, mask_img)
+    _, code, mask = fou_enc.encode_iris(norm_img, mask_img, angles, radii)
+    _, packed_code, packed_mask = fou_enc.encode_iris(norm_img, mask_img, angles, radii, packed=True)
+
+    # the packed template must be the packed version of the unpacked one
+    same_result = np.array_equal(loop_code[0::2], code[0::2]) and np.array_equal(loop_mask, mask) and \
+        np.array_equal(np.packbits(code), packed_code) and np.array_equal(np.packbits(mask), packed_mask)
+
+    imag_changed = np.count_nonzero(loop_code[1::2] != code[1::2]) / float(code[1::2].size)
+
+    loop_time = time_function(fourier_encode_loop, (norm_img, mask_img), repeat)
+    vectorized_time = time_function(fou_enc.encode_iris, (norm_img, mask_img, angles, radii), repeat)
+    packed_time = time_function(fou_enc.encode_iris, (norm_img, mask_img, angles, radii, True), repeat)
+
+    return same_result, imag_changed, loop_time, vectorized_time, packed_time
+
+# ----------------------------------------------------------------------------------
+
+
+# builds the zernike basis matrix evaluating the scalar polynomials cell by cell
+def zernike_basis_loop(width, height, order, eps_lb=None, eps_ub=None):
+    circular = eps_lb is None
+
+    Mf = np.empty((width * height, order), np.float64)
+    for j in range(1, order + 1):
+        rect = np.empty((height, width), np.float64)
+
+        for a in range(width):
+            theta = a * (2 * pi) / width
+
+            for r in range(height):
+                if circular:
+                    dr = 1.0 / height
+                    rect[r, a] = ZernikeCircularSingle(j, dr + r * dr, theta)
+                else:
+                    dr = (eps_ub - eps_lb) / (height - 1)
+                    rect[r, a] = ZernikeAnnularSingle(j, eps_lb + r * dr, theta, eps_lb, eps_ub)
+
+        Mf[:, j - 1] = rect.reshape((width * height,))
+
+    return Mf
+
+
+# builds the zernike basis matrix with the vectorized polynomials (not cached)
+def zernike_basis_vectorized(width, height, order, eps_lb=None, eps_ub=None):
+    Mf = np.empty((width * height, order), np.float64)
+    for j in range(1, order + 1):
+        if eps_lb is None:
+            rect = fda_enc.FillRectCircular(width, height, j)
+        else:
+            rect = fda_enc.FillRectAnnular(width, height, j, eps_lb, eps_ub)
+
+        Mf[:, j - 1] = rect.reshape((width * height,))
+
+    return Mf
+
+
+# validates the vectorized zernike basis matrices (circular and annular) against the
+# scalar polynomials, returns the max absolute differences and both running times
+def benchmark_zernike_basis(width=STD_ANGLES, height=STD_RADII, order=DEFAULT_ZERNIKE_ORDER,
+                            eps_lb=DEFAULT_EPS_INT, eps_ub=DEFAULT_EPS_EXT):
+    results = []
+    for lb, ub in ((None, None), (eps_lb, eps_ub)):
+        args = (width, height, order, lb, ub)
+
+        max_error = np.abs(zernike_basis_loop(*args) - zernike_basis_vectorized(*args)).max()
+
+        loop_time = time_function(zernike_basis_loop, args, 1)
+        vectorized_time = time_function(zernike_basis_vectorized, args, 1)
+
+        results.append((max_error, loop_time, vectorized_time))
+
+    return results
+
+# ----------------------------------------------------------------------------------
+
+
+# compares the zernike moments computed by orthogonal projection against the QR solution
+# of the least squares problem (as cv2.solve computed them for every image). Returns the
+# relative error of the moments for the image and for the image with its mean removed (the
+# basis has no piston term, so the least squares solution spreads the mean over the other
+# polynomials), the relative residuals of both reconstructions and the times per image
+def benchmark_zernike_moments(width=STD_ANGLES, height=STD_RADII, order=DEFAULT_ZERNIKE_ORDER,
+                              eps_lb=DEFAULT_EPS_INT, eps_ub=DEFAULT_EPS_EXT, repeat=BENCHMARK_REPEAT):
+    norm_img, mask_img = random_normalized_iris(height, width)
+
+    # the image is smoothed, so it can be approximated by low order polynomials
+    norm_img = cv2.GaussianBlur(norm_img, (0, 0), 3).astype(np.float64)
+    zero_mean_img = norm_img - norm_img.mean()
+
+    results = []
+    for circular in (True, False):
+        if circular:
+            A = np.asarray(fda_enc.ComputeMfCircular(width, height, order))
+            projection = lambda img: zcp_enc.encode_iris(img, order, None, ZERNIKE_PROJECTION)[1][:, 0]
+        else:
+            A = np.asarray(fda_enc.ComputeMfAnnular(width, height, order, eps_lb, eps_ub))
+            projection = lambda img: zap_enc.encode_iris(img, mask_img, order, eps_lb, eps_ub, False, ZERNIKE_PROJECTION)[1][:, 0]
+
+        qr_solve = lambda img: cv2.solve(A, img.reshape((height * width,)), flags=cv2.DECOMP_QR)[1][:, 0]
+
+        errors = []
+        for img in (norm_img, zero_mean_img):
+            x_qr = qr_solve(img)
+            errors.append(np.linalg.norm(projection(img) - x_qr) / np.linalg.norm(x_qr))
+
+        b = norm_img.reshape((height * width,))
+        qr_residual = np.linalg.norm(A.dot(qr_solve(norm_img)) - b) / np.linalg.norm(b)
+        proj_residual = np.linalg.norm(A.dot(projection(norm_img)) - b) / np.linalg.norm(b)
+
+        qr_time = time_function(qr_solve, (norm_img,), repeat)
+        proj_time = time_function(projection, (norm_img,), repeat)
+
+        results.append((errors[0], errors[1], qr_residual, proj_residual, qr_time, proj_time))
+
+    return results
+
+
+# ----------------------------------------------------------------------------------
+
+
+# times both normalizers with nearest and bilinear interpolation on a random eye image.
+# Returns (nearest_time, bilinear_time) for the concentric and rubber-sheet normalizers
+def benchmark_interpolation(radii=STD_RADII, angles=STD_ANGLES, repeat=BENCHMARK_REPEAT):
+    rng = np.random.RandomState(0)
+    eye_img = rng.randint(0, 256, (280, 320)).astype(np.uint8)
+
+    pupil_center, pupil_radius = (160.3, 140.7), 40
+    iris_center, iris_radius = (162, 138), 100
+
+    results = []
+    for normalize_iris in (proj_iris_norm.normalize_iris, rubb_sheet_norm.normalize_iris):
+        times = []
+        for interpolation in (NEAREST_INTERPOLATION, BILINEAR_INTERPOLATION):
+            args = (eye_img, angles, radii, pupil_center, pupil_radius, iris_center, iris_radius, None, None, interpolation)
+            times.append(time_function(normalize_iris, args, repeat))
+
+        results.append(tuple(times))
+
+    return results
+
+# ----------------------------------------------------------------------------------
+
+
+# per pixel implementation of the add blend (previous to the array one)
+def add_blend_loop(src, other):
+    height, width = src.shape
+    result = np.empty(src.shape, np.uint8)
+
+    for i in range(height):
+        for j in range(width):
+            pix_value = min(src.item(i, j) + other.item(i, j), 255)
+            result.itemset(i, j, 255 - pix_value)
+
+    return result
+
+
+# per pixel implementation of the image masking (previous to the array one)
+def mask_image_loop(img, mask):
+    img_height, img_width = img.shape
+    masked_image = np.empty(img.shape, np.uint8)
+
+    for i in range(img_height):
+        for j in range(img_width):
+            if mask[i, j]:
+                masked_image[i, j] = img[i, j]
+            else:
+                masked_image[i, j] = 0 if i % 2 == 0 or j % 2 == 0 else 200
+
+    return masked_image
+
+
+# compares the per pixel add blend and image masking against the array ones on a random eye
+# image. Returns (same_result, loop_time, array_time) for each of them
+def benchmark_blending(height=280, width=320, repeat=BENCHMARK_REPEAT):
+    rng = np.random.RandomState(0)
+    src = rng.randint(0, 256, (height, width)).astype(np.uint8)
+    other = rng.randint(0, 256, (height, width)).astype(np.uint8)
+    mask = (rng.rand(height, width) > 0.3).astype(np.uint8)
+
+    results = []
+    for loop_func, array_func, args in ((add_blend_loop, proj_iris_segm.add_blend, (src, other)),
+                                        (mask_image_loop, mask_image, (src, mask))):
+        same_result = np.array_equal(loop_func(*args), array_func(*args))
+        results.append((same_result, time_function(loop_func, args, repeat), time_function(array_func, args, repeat)))
+
+    return results
+
+# ----------------------------------------------------------------------------------
+
+
+# reads the (grayscale) eye images of a folder, none if it does not exist
+def read_sample_images(images_path=SAMPLE_IMAGES_PATH):
+    if not os.access(images_path, os.F_OK):
+        return []
+
+    eye_imgs = [cv2.imread(images_path + img_name, cv2.IMREAD_GRAYSCALE) for img_name in sorted(os.listdir(images_path))]
+
+    return [eye_img for eye_img in eye_imgs if eye_img is not None]
+
+
+# times the iris circle search of the project iris segmentation on the sample eye images, with
+# the same input segment_iris gives it (the grayscale eye image and the detected pupil
+# center). Returns the average time and the number of images where an iris was found out of
+# the number of images whose pupil was found
+def benchmark_find_iris(hough_backend=HOUGH_ACCUMULATOR, images_path=SAMPLE_IMAGES_PATH, repeat=BENCHMARK_REPEAT):
+    elapsed = 0.0
+    found = 0
+    count = 0
+    for eye_img in read_sample_images(images_path):
+        pupil_data = proj_iris_segm.find_pupil(eye_img)
+        if pupil_data is None:
+            continue
+
+        args = (eye_img, pupil_data[0], hough_backend)
+        found += proj_iris_segm.find_iris(*args) is not None
+        elapsed += time_function(proj_iris_segm.find_iris, args, repeat)
+        count += 1
+
+    return elapsed / max(1, count), found, count
+
+
+# times the project iris segmentation of the sample eye images. Returns the average time and
+# the number of images segmented out of the number of images
+def benchmark_segmentation(hough_backend=HOUGH_ACCUMULATOR, images_path=SAMPLE_IMAGES_PATH, repeat=BENCHMARK_REPEAT):
+    eye_imgs = read_sample_images(images_path)
+
+    segmented = sum(proj_iris_segm.segment_iris(eye_img, hough_backend)[0] == SUCCESS for eye_img in eye_imgs)
+    elapsed = sum(time_function(proj_iris_segm.segment_iris, (eye_img, hough_backend), repeat) for eye_img in eye_imgs)
+
+    return elapsed / max(1, len(eye_imgs)), segmented, len(eye_imgs)
+
+# ----------------------------------------------------------------------------------
+
+
+# encodes every (normalized) image of a test database in double and single precision and
+# measures how much the single precision drifts. Returns the number of encoded images, the
+# max and mean template drift (fraction of different bits for binary templates, relative
+# difference for vector ones), the max absolute drift of the distances between every pair
+# of templates and the number of images whose nearest neighbour class changes. Returns None
+# if the database is not available
+def precision_drift_report(db_type, encoding_method, use_mask=False, polynomial_order=DEFAULT_ZERNIKE_ORDER,
+                           eps_int=DEFAULT_EPS_INT):
+    # reading image names from database
+    db_path = get_base_path(db_type)
+    images_path = db_path + IMAGES_PATH
+    if not os.access(images_path, os.F_OK):
+        return None
+
+    db_images = sorted(os.listdir(images_path))
+
+    # creating one recognition algorithm per precision
+    algs = []
+    for precision in (DOUBLE_PRECISION, SINGLE_PRECISION):
+        alg = RecognitionAlgorithm()
+        alg.set_encoding_method(encoding_method)
+        alg.set_polynomial_order(polynomial_order)
+        alg.set_internal_epsilon(eps_int)
+        alg.set_precision(precision)
+        algs.append(alg)
+
+    # encoding every image in both precisions
+    names = []
+    templates = ([], [])
+    for img_name in db_images:
+        img = cv2.imread(images_path + img_name, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            continue
+
+        if use_mask:
+            img_mask = np.load(db_path + MASKS_PATH + img_name[0:len(img_name) - 4] + ".npy")
+        else:
+            img_mask = np.ones(img.shape, np.uint8)
+
+        codes = [alg.encode(img, img_mask) for alg in algs]
+        if codes[0][0] != SUCCESS or codes[1][0] != SUCCESS:
+            continue
+
+        names.append(img_name)
+        for k in range(2):
+            templates[k].append(codes[k][1:])
+
+    count = len(names)
+    if count == 0:
+        return 0, 0.0, 0.0, 0.0, 0
+
+    drifts, distances, distance_drift = compute_precision_drift(encoding_method, algs, templates)
+
+    nearest = distances.argmin(axis=2)
+    changed = 0
+    for i in range(count):
+        classes = [get_image_class(names[nearest[k, i]], db_type) for k in range(2)]
+        changed += classes[0] != classes[1]
+
+    return count, drifts.max(), drifts.mean(), distance_drift, changed
+
+
+# segments, normalizes and encodes the sample eye images in double and single precision (as
+# precision_drift_report, for when no test database is available). Returns the number of
+# encoded images, the max and mean template drift, the max absolute drift of the distances
+# between every pair of templates and the smallest distance between two templates (in
+# double precision), so the distance drift can be compared with it
+def sample_precision_drift_report(encoding_method, zernike_method=ZERNIKE_LEAST_SQUARES,
+                                  polynomial_order=DEFAULT_ZERNIKE_ORDER, images_path=SAMPLE_IMAGES_PATH):
+    # creating one recognition algorithm per precision
+    algs = []
+    for precision in (DOUBLE_PRECISION, SINGLE_PRECISION):
+        alg = RecognitionAlgorithm()
+        alg.set_encoding_method(encoding_method)
+        alg.set_zernike_method(zernike_method)
+        alg.set_polynomial_order(polynomial_order)
+        alg.set_precision(precision)
+        algs.append(alg)
+
+    # encoding every sample image in both precisions
+    templates = ([], [])
+    for eye_img in read_sample_images(images_path):
+        codes = [alg.get_template(eye_img) for alg in algs]
+        if codes[0][0] != SUCCESS or codes[1][0] != SUCCESS:
+            continue
+
+        for k in range(2):
+            templates[k].append(codes[k][1:])
+
+    count = len(templates[0])
+    if count == 0:
+        return 0, 0.0, 0.0, 0.0, 0.0
+
+    drifts, distances, distance_drift = compute_precision_drift(encoding_method, algs, templates)
+
+    return count, drifts.max(), drifts.mean(), distance_drift, distances[0].min()
+
+
+# Returns the drift of every template (fraction of different bits for binary templates,
+# relative difference for vector ones), the distances between every pair of templates in
+# both precisions (inf in the diagonal) and the max absolute drift of those distances.
+# templates holds the (code, mask) pairs of the double and the single precision algorithms
+def compute_precision_drift(encoding_method, algs, templates):
+    count = len(templates[0])
+
+    # drift of the templates themselves
+    drifts = np.empty(count, np.float64)
+    for i in range(count):
+        code_64 = templates[0][i][0]
+        code_32 = templates[1][i][0]
+
+        if generates_binary_template(encoding_method):
+            drifts[i] = np.count_nonzero(code_64 != code_32) / code_64.size
+        else:
+            drifts[i] = np.linalg.norm(code_64 - code_32) / np.linalg.norm(code_64)
+
+    # drift of the distances between every pair of templates
+    distances = np.full((2, count, count), np.inf)
+    for k in range(2):
+        for i in range(count):
+            for j in range(count):
+                if i != j:
+                    distances[k, i, j] = algs[k].get_distance(*(templates[k][i] + templates[k][j]))
+
+    off_diagonal = np.isfinite(distances[0])
+    distance_drift = np.abs(distances[0][off_diagonal] - distances[1][off_diagonal]).max() if count > 1 else 0.0
+
+    return drifts, distances, distance_drift
+
+# ----------------------------------------------------------------------------------
+
+
+if __name__ == "__main__":
+    same, imag_changed, loop_ms, vect_ms, packed_ms = benchmark_fourier_encoding()
+    print("fourier encoding: loop = %.3f ms, vectorized = %.3f ms, packed = %.3f ms, same real bits and mask = %s, imaginary bits fixed = %.3f" %
+          (loop_ms, vect_ms, packed_ms, same, imag_changed))
+
+    circular, annular = benchmark_zernike_basis()
+    print("zernike circular basis: loop = %.3f ms, vectorized = %.3f ms, max error = %g" % (circular[1], circular[2], circular[0]))
+    print("zernike annular basis: loop = %.3f ms, vectorized = %.3f ms, max error = %g" % (annular[1], annular[2], annular[0]))
+
+    for name, moments in zip(("circular", "annular"), benchmark_zernike_moments()):
+        error, zero_mean_error, qr_res, proj_res, qr_ms, proj_ms = moments
+        print("zernike %s moments: qr = %.3f ms, projection = %.3f ms (x%.1f), moments error = %g (zero mean = %g), residual qr = %g, projection = %g" %
+              (name, qr_ms, proj_ms, qr_ms / proj_ms, error, zero_mean_error, qr_res, proj_res))
+
+    for name, times in zip(("concentric", "rubber-sheet"), benchmark_interpolation()):
+        print("%s normalization: nearest = %.3f ms, bilinear = %.3f ms" % (name, times[0], times[1]))
+
+    for name, (same, loop_ms, array_ms) in zip(("add blend", "image masking"), benchmark_blending()):
+        print("%s: loop = %.3f ms, array = %.3f ms, same result = %s" % (name, loop_ms, array_ms, same))
+
+    for backend, backend_name in ((HOUGH_ACCUMULATOR, "accumulator"), (HOUGH_OPENCV, "opencv")):
+        elapsed, found, count = benchmark_find_iris(backend)
+        print("iris circle search (%s hough, grayscale eye image): %.3f ms, iris found in %i of %i images" % (backend_name, elapsed, found, count))
+
+    for backend, backend_name in ((HOUGH_ACCUMULATOR, "accumulator"), (HOUGH_OPENCV, "opencv")):
+        elapsed, segmented, count = benchmark_segmentation(backend)
+        print("segmentation (%s hough): %.3f ms, segmented %i of %i images" % (backend_name, elapsed, segmented, count))
+
+    encoding_names = ((LOG_GABOR_ENCODING, LOG_GABOR_ENCODING_STR), (ZCP_ENCODING, ZCP_ENCODING_STR),
+                      (ZAP_ENCODING, ZAP_ENCODING_STR), (FOURIER_ENCODING, FOURIER_ENCODING_STR))
+    for db_type in (UPOL, CASIA_1, MMU, UBIRIS):
+        for encoding_method, encoding_name in encoding_names:
+            report = precision_drift_report(db_type, encoding_method)
+            if report is None:
+                break
+
+            count, max_drift, mean_drift, distance_drift, changed = report
+            print("single precision drift (%s, %s): images = %i, template drift max = %g, mean = %g, distance drift = %g, nearest changed = %i" %
+                  (get_base_path(db_type), encoding_name, count, max_drift, mean_drift, distance_drift, changed))
+
+    # the zernike encodings are measured with both methods (the others do not use it)
+    zernike_methods = ((ZERNIKE_LEAST_SQUARES, "least squares"), (ZERNIKE_PROJECTION, "projection"))
+    for encoding_method, encoding_name in encoding_names:
+        methods = zernike_methods if generates_vector_template(encoding_method) else ((ZERNIKE_LEAST_SQUARES, None),)
+        for zernike_method, zernike_name in methods:
+            name = encoding_name if zernike_name is None else "%s, %s" % (encoding_name, zernike_name)
+
+            count, max_drift, mean_drift, distance_drift, min_distance = sample_precision_drift_report(encoding_method, zernike_method)
+            print("single precision drift (sample images, %s): images = %i, template drift max = %g, mean = %g, distance drift = %g (min distance = %g)" %
+                  (name, count, max_drift, mean_drift, distance_drift, min_distance))
@@ -1,5 +1,28 @@
+import cv2
 import numpy as np
 
+from utils.recognition_definitions import NEAREST_INTERPOLATION, BILINEAR_INTERPOLATION
+
+#--------------------------------------------------------------------------------
+
+# heatmap colors, indexed by 2 * imag + real (the sign bits of an encoded pixel)
+HEATMAP_COLORS = np.array([[217, 179, 145],    # imag = 0, real = 0
+                           [120, 120, 120],    # imag = 0, real = 1
+                           [91, 140, 77],      # imag = 1, real = 0
+                           [91, 102, 166]],    # imag = 1, real = 1
+                          np.uint8)
+
+# rows at the top and bottom of the heatmap that are not colored
+HEATMAP_BORDER = 4
+
+# value of the odd pixels (odd row and column) of the checkerboard of the masked out pixels
+MASK_PATTERN_VALUE = 200
+
+# checkerboard patterns already computed, indexed by shape
+checkerboards = {}
+
+#--------------------------------------------------------------------------------
+
 
 # determines if a pixel is valid in certain image
 def valid_pixel(arr, x, y):
@@ -7,31 +30,61 @@ def valid_pixel(arr, x, y):
     return 0 <= x < width and 0 <= y < height
 
 
-#ToDo: Python code here. Optimize it with cython or anything like that.
-# masks an grayscale image
+# samples the image at the coordinates of the arrays x and y. Returns the sampled pixels and
+# the boolean array of the coordinates inside the image. With nearest interpolation the
+# coordinates are truncated as int does and, as with img.item, the negative ones are taken
+# from the end of the image. With bilinear interpolation the image is remapped by opencv
+def sample_pixels(img, x, y, interpolation=NEAREST_INTERPOLATION):
+    height, width = img.shape
+
+    valid = (0 <= x) & (x < width) & (0 <= y) & (y < height)
+
+    if interpolation == BILINEAR_INTERPOLATION:
+        pixels = cv2.remap(img, np.float32(x), np.float32(y), cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    else:
+        pixels = img[y.astype(np.int64) % height, x.astype(np.int64) % width]
+
+    return pixels, valid
+
+
+# masks an grayscale image: the masked out pixels show the checkerboard pattern
 def mask_image(img, mask):
     # both must be valid arrays
     if img is None or mask is None:
         return None
 
-    img_height, img_width = img.shape
-    mask_height, mask_width = mask.shape
-
     # must be of same size
-    if img_height != mask_height or img_width != mask_width:
+    if img.shape != mask.shape:
         return None
 
-    # creating masked image array
-    masked_image = np.empty(img.shape, np.uint8)
+    # taking the pixel if it is ok, the pattern otherwise
+    return np.where(mask != 0, img, get_checkerboard(img.shape)).astype(np.uint8)
+
+
+# Returns the pattern shown on the masked out pixels: 0 in the even rows and columns, and
+# MASK_PATTERN_VALUE elsewhere. It is computed once per shape
+def get_checkerboard(shape):
+    if shape in checkerboards:
+        return checkerboards[shape]
+
+    checkerboard = np.zeros(shape, np.uint8)
+    checkerboard[1::2, 1::2] = MASK_PATTERN_VALUE
+    checkerboard.flags.writeable = False
+
+    checkerboards[shape] = checkerboard
+
+    return checkerboard
+
 
-    for i in range(img_height):
-        for j in range(img_width):
-            # if pixel is ok
-            if mask[i, j]:
-                pixel_value = img[i, j]
-            else:
-                pixel_value = 0 if i % 2 == 0 or j % 2 == 0 else 200
+# colors the sign planes (real, imag) of an encoded image, with black border rows
+def render_heatmap(real, imag, border=HEATMAP_BORDER):
+    # mapping every pixel to its color in a single lookup
+    color_index = 2 * (imag != 0) + (real != 0)
+    heatmap = HEATMAP_COLORS[color_index]
 
-            masked_image[i, j] = pixel_value
+    # setting black color in the borders (pupil/iris and iris/sclera)
+    radii = heatmap.shape[0]
+    heatmap[:border + 1] = 0
+    heatmap[radii - border:] = 0
 
-    return masked_image
\ No newline at end of file
+    return heatmap
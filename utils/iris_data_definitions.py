@@ -1,3 +1,5 @@
+import numpy as np
+
 PUPIL_DATA = 0      # (pupil center, pupil radius)
 IRIS_DATA = 1       # (iris center, iris radius)
 EYELIDS_DATA = 2    # ((p1, p2, p3), (p4, p5, p6))
@@ -7,3 +9,30 @@ RADIUS = 1
 
 X = 0
 Y = 1
+
+# normalization parameters of a segmented eye, as a record of a structured array. The
+# eyelids are the coefficients (A, B, C) of their parabolas, nan if there is no eyelid
+NORMALIZATION_PARAMS_DTYPE = np.dtype([("pupil_center", np.float64, (2,)),
+                                       ("pupil_radius", np.float64),
+                                       ("iris_center", np.float64, (2,)),
+                                       ("iris_radius", np.float64),
+                                       ("upper_eyelid", np.float64, (3,)),
+                                       ("lower_eyelid", np.float64, (3,))])
+
+
+# creates the normalization parameters (one record) of a segmented eye, None is stored as nan
+def normalization_params(pupil_center, pupil_radius, iris_center, iris_radius, upper_eyelid, lower_eyelid):
+    params = np.full(1, np.nan, NORMALIZATION_PARAMS_DTYPE)[0]
+
+    params["pupil_center"] = pupil_center
+    params["pupil_radius"] = pupil_radius
+    params["iris_radius"] = iris_radius
+
+    if iris_center is not None:
+        params["iris_center"] = iris_center
+    if upper_eyelid is not None:
+        params["upper_eyelid"] = upper_eyelid
+    if lower_eyelid is not None:
+        params["lower_eyelid"] = lower_eyelid
+
+    return params
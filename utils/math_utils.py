@@ -1,5 +1,8 @@
 from math import sqrt, pow, fabs
 
+import cv2
+import numpy as np
+
 DBL_MAX = 1.7976931348623158e+308   #taken from Visual C++
 
 DBL_EPS = 0.0000000000001
@@ -93,6 +96,19 @@ def is_between_parabolas_coords(parabola_1, parabola_2, x, y):
     return in_parabola_coords(A1, B1, C1, x, y) and in_parabola_coords(A2, B2, C2, x, y)
 
 
+# vectorized version of is_between_parabolas_coords, returns a boolean array with the shape of
+# the coordinate arrays x and y. A parabola with nan coefficients is taken as no parabola
+def between_parabolas_mask(parabola_1, parabola_2, x, y):
+    mask = np.ones(np.shape(x), np.bool_)
+
+    for parabola in (parabola_1, parabola_2):
+        if parabola is not None and not np.isnan(parabola).any():
+            A, B, C = parabola
+            mask &= in_parabola_coords(A, B, C, x, y)
+
+    return mask
+
+
 def is_between_parabolas_point(parabola_1, parabola_2, p):
     x = p.x()
     y = p.y()
@@ -128,3 +144,34 @@ def compute_circle_center_points(p1, p2, p3):
 
     return compute_circle_center_coords(x1, y1, x2, y2, x3, y3)
 
+
+# 2D discrete fourier transform of a real image (or of every image of a stack). In single
+# precision it is computed by opencv, because numpy always transforms in double precision
+def fft2(img, dtype=np.float64):
+    if np.dtype(dtype) == np.float32:
+        if img.ndim == 3:
+            return np.array([fft2(layer, dtype) for layer in img])
+
+        spectrum = cv2.dft(np.float32(img), flags=cv2.DFT_COMPLEX_OUTPUT)
+        return spectrum.view(np.complex64)[..., 0]
+
+    return np.fft.fft2(img)
+
+
+# discrete fourier transform of every row of a real image (in the given precision)
+def fft_rows(img, dtype=np.float64):
+    if np.dtype(dtype) == np.float32:
+        spectrum = cv2.dft(np.float32(img), flags=cv2.DFT_ROWS | cv2.DFT_COMPLEX_OUTPUT)
+        return spectrum.view(np.complex64)[..., 0]
+
+    return np.fft.fft(img, axis=1)
+
+
+# inverse discrete fourier transform of every row of a complex image (in its own precision)
+def ifft_rows(spectrum):
+    if spectrum.dtype == np.complex64:
+        planes = np.ascontiguousarray(spectrum).view(np.float32).reshape(spectrum.shape + (2,))
+        signal = cv2.idft(planes, flags=cv2.DFT_ROWS | cv2.DFT_SCALE | cv2.DFT_COMPLEX_OUTPUT)
+        return signal.view(np.complex64)[..., 0]
+
+    return np.fft.ifft(spectrum, axis=1)
@@ -3,6 +3,9 @@ INVALID_METHOD = 0
 PROJECT_IRIS_SEGMENTATION = 1
 VASIR_SEGMENTATION = 2
 
+HOUGH_ACCUMULATOR = 1           # circle hough transform voting black pixels into an (a, b, r) accumulator
+HOUGH_OPENCV = 2                # circle hough transform of opencv (gradient method)
+
 PROJECT_IRIS_NORMALIZATION = 1
 RUBBERSHEET_NORMALIZATION = 2
 
@@ -21,6 +24,18 @@ FOURIER_ENCODING_STR = "Discrete Fourier Transform"
 HAMMING_DISTANCE = 1
 EUCLIDEAN_DISTANCE = 2
 
+ZERNIKE_LEAST_SQUARES = 1       # zernike moments as the least squares solution of Mf * x = b
+ZERNIKE_PROJECTION = 2          # zernike moments as inner products with the (orthogonal) basis
+# the projection is only an approximation: the basis is not orthogonal on the sampled grid, so its
+# moments differ from the least squares ones (about 100% on raw images, 6-17% with the mean removed)
+# and templates encoded with one method can not be matched against templates encoded with the other
+
+DOUBLE_PRECISION = 1            # numeric work in float64 / complex128
+SINGLE_PRECISION = 2            # numeric work in float32 / complex64
+
+NEAREST_INTERPOLATION = 1       # normalization takes the pixel of the (truncated) sampled coordinates
+BILINEAR_INTERPOLATION = 2      # normalization interpolates the four pixels around the sampled coordinates
+
 MIN_ANGULAR_RESOLUTION = 45
 MAX_ANGULAR_RESOLUTION = 360
 